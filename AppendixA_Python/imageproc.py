@@ -1,12 +1,119 @@
+import contextlib
 import numpy as np
-import matplotlib.pyplot as plt
+import scipy.fft
 from scipy.ndimage import gaussian_filter
+try:
+    from instrument import stage    # optional timing of the stages (AppendixB_Python)
+except ImportError:
+    stage = lambda name,**info: contextlib.nullcontext()
 
-def get_image_max(file,n):
-    A = plt.imread(file)
-    A = np.mean(A[:,:,0:2],2)
-    A = gaussian_filter(A, np.round(n/2)) 
-    maxval = np.max(A) 
+FFT_MIN_SIGMA = 3           # 'auto' smooths by FFT from this sigma (pixels) up
+DECIMATE_MIN_SIGMA = 8      # and finds the peak on a decimated image from this sigma up
+TRUNCATE = 4.0              # Gaussian kernels are cut off at TRUNCATE*sigma (as gaussian_filter)
+
+def get_image_max(file,n,dtype=np.float64,method='auto',return_location=False):
+    """Reads an image file, converts it to greyscale and returns its maximum
+    after smoothing over about n pixels. See image_max() for the options."""
+    with stage('decode'):
+        import matplotlib.image as mpimg    # only needed to read files
+        A = mpimg.imread(file)
+    with stage('greyscale'):
+        A = np.mean(A[:,:,0:2],2,dtype=dtype)   # np.float32 halves the memory
+    return image_max(A,n,method,return_location)
+
+def image_max(A,n,method='auto',return_location=False):
+    """Returns the maximum of the image A after smoothing it with a Gaussian
+    of width sigma = round(n/2) pixels. With return_location=True the
+    (row, column) index of the maximum is returned as well.
+
+    SYNTAX: maxval = image_max(A,n <,method,return_location>);
+            maxval,(row,col) = image_max(A,n,method,True);
+            <...> indicates optional arguments
+
+    method = 'direct'   : scipy's gaussian_filter (the original method)
+             'fft'      : the same smoothing done as a product in the Fourier
+                          domain; its cost doesn't grow with sigma
+             'decimate' : the peak is found on a block-averaged copy of the
+                          image and its value is then computed at full
+                          resolution in a small window around it
+             'auto'     : (default) chosen from sigma and the image size
+
+    All methods give the same result to within rounding, as long as the
+    image has a single dominant peak (required by 'decimate'). The
+    precision (float32 or float64) of A is kept throughout."""
+
+    sigma = np.round(n/2)
+    if method=='auto':
+        if sigma<FFT_MIN_SIGMA:
+            method = 'direct'
+        elif sigma>=DECIMATE_MIN_SIGMA and min(np.shape(A))>=16*sigma:
+            method = 'decimate'
+        else:
+            method = 'fft'
+
+    if method=='decimate':
+        with stage('smoothing',method=method):  # smoothing and peak search in one
+            maxval,loc = _decimated_max(A,sigma)
+    else:
+        with stage('smoothing',method=method):
+            if method=='fft':
+                A = smooth_fft(A,sigma)
+            elif method=='direct':
+                A = gaussian_filter(A,sigma)
+            else:
+                raise ValueError("Unknown smoothing method '"+str(method)+"'")
+        with stage('peak'):
+            loc = np.unravel_index(np.argmax(A),np.shape(A))
+            maxval = A[loc]
+
+    if return_location:
+        return maxval,tuple(int(i) for i in loc)
     return maxval
 
+def smooth_fft(A,sigma):
+    """Smooths the image A with a Gaussian of width sigma (pixels), giving
+    the same result as gaussian_filter(A,sigma), but by multiplying Fourier
+    transforms. The image is padded by reflection so the edges are treated
+    as gaussian_filter does.
+
+    SYNTAX: As = smooth_fft(A,sigma);"""
+
+    if sigma==0:
+        return A.copy()
+    r = int(TRUNCATE*sigma+0.5)                 # kernel radius used by gaussian_filter
+    x = np.arange(-r,r+1)
+    k = np.exp(-0.5*(x/sigma)**2)
+    k = k/np.sum(k)                             # normalized 1D Gaussian kernel
+
+    N1,N2 = np.shape(A)
+    s = (scipy.fft.next_fast_len(N1+2*r),scipy.fft.next_fast_len(N2+2*r,real=True))
+    P = np.pad(A,r,mode='symmetric')            # same as gaussian_filter's 'reflect'
+    cdtype = np.result_type(A.dtype,np.complex64)
+    K1 = scipy.fft.fft(k,s[0]).astype(cdtype)   # the Gaussian is separable, so its
+    K2 = scipy.fft.rfft(k,s[1]).astype(cdtype)  # 2D transform is an outer product
+    F = scipy.fft.rfft2(P,s)
+    F *= K1[:,None]
+    F *= K2[None,:]
+    As = scipy.fft.irfft2(F,s)
+    return As[2*r:2*r+N1,2*r:2*r+N2]            # the kernel starts at index 0, not -r
+
+def _decimated_max(A,sigma):
+    # Find the peak on an image block-averaged by d in each direction, smoothed
+    # so that its total width still corresponds to sigma at full resolution.
+    d = max(int(sigma//4),1)
+    N1,N2 = np.shape(A)
+    M1,M2 = N1//d,N2//d
+    B = np.mean(np.reshape(A[:M1*d,:M2*d],(M1,d,M2,d)),axis=(1,3),dtype=A.dtype)
+    B = gaussian_filter(B,np.sqrt(max(sigma**2-(d**2-1)/12,0))/d)
+    i,j = np.unravel_index(np.argmax(B),np.shape(B))
 
+    # Then smooth only a small full resolution window around it. The window has
+    # a margin of one kernel radius, so the values in its middle are exact.
+    r = int(TRUNCATE*sigma+0.5)
+    a0 = max(i*d-d,0); a1 = min(i*d+2*d,N1)     # rows and columns searched
+    b0 = max(j*d-d,0); b1 = min(j*d+2*d,N2)
+    w0 = max(a0-r,0); v0 = max(b0-r,0)
+    W = gaussian_filter(A[w0:min(a1+r,N1),v0:min(b1+r,N2)],sigma)
+    W = W[a0-w0:a1-w0,b0-v0:b1-v0]
+    k,l = np.unravel_index(np.argmax(W),np.shape(W))
+    return W[k,l],(a0+k,b0+l)
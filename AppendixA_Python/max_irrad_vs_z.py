@@ -7,36 +7,36 @@
 # to reduce laser speckle by smoothing the image. This requires the user to
 # be judicious in the choice of nsmooth, the linear smoothing size in pixels. 
 # 
-# Requires: get_image_max
-
-import numpy as np
-import matplotlib.pyplot as plt
-from imageproc import get_image_max
-import os
-
+# Requires: get_image_max, scan_max_irradiance
 
+import contextlib
+from zscan import scan_max_irradiance
+try:
+    from instrument import stage,report  # optional timing of the stages (INSTRUMENT=1);
+except ImportError:                      # needs AppendixB_Python on the path
+    stage = lambda name,**info: contextlib.nullcontext()
+    report = lambda: None
 
 image_folder = 'sample_images'   # relative or absolute path to the images directory
 image_extension = '.tif'         # filename extension ofthe images
 nsmooth = 32                     # number of pixels over which to smooth the images
+cache_file = None                # e.g. 'zscan_cache.json' to keep results between runs
 
-images = os.listdir(image_folder)
-posvals = np.array([])
-maxvals = np.array([])
+if __name__ == '__main__':       # needed because the images are processed in parallel
+    import matplotlib.pyplot as plt  # here, so the worker processes don't load it
 
-for s in range(1,len(images)):
-    
-    fdir,fnameext = os.path.split(images[s])
-    fname,fext = os.path.splitext(fnameext)
-    fullpath = os.path.join(image_folder, fnameext)
-    if fext==image_extension:
-         posvals = np.concatenate((posvals,\
-                   [float(fname)]));
-         maxvals =  np.concatenate((maxvals,\
-                   [get_image_max(fullpath,nsmooth)]))
+    # The images are processed by several worker processes at once. If a
+    # cache_file is given, only new or changed images are processed when the
+    # script is run again.
+    # With INSTRUMENT=1 set (and AppendixB_Python on the path), the time spent
+    # on each stage is printed; add processes=1 to see every image.
+    with stage('scan'):
+        posvals,maxvals = scan_max_irradiance(image_folder,image_extension,nsmooth,
+                                              cache_file=cache_file)
+    report()
 
-plt.plot(posvals,maxvals,'bs',linewidth=2);
-plt.grid(True)
-plt.xlabel('Position  ( mm )');
-plt.ylabel('Max. Irradiance  ( arb. units )');
-plt.show()
\ No newline at end of file
+    plt.plot(posvals,maxvals,'bs',linewidth=2);
+    plt.grid(True)
+    plt.xlabel('Position  ( mm )');
+    plt.ylabel('Max. Irradiance  ( arb. units )');
+    plt.show()
@@ -0,0 +1,112 @@
+# zscan.py
+#
+# Finds the maximum (smoothed) irradiance in every image of a z-scan. The
+# image filenames are the positions at which the images were taken. The
+# images are processed in parallel, and the results can be kept in a cache
+# file so that running the scan again only processes new or changed images.
+#
+# Requires: get_image_max
+
+import os
+import json
+import contextlib
+import multiprocessing
+import numpy as np
+from imageproc import get_image_max
+try:
+    from instrument import stage                # optional timing (AppendixB_Python)
+except ImportError:
+    stage = lambda name,**info: contextlib.nullcontext()
+
+def scan_max_irradiance(image_folder, image_extension='.tif', nsmooth=32,
+                        processes=None, cache_file=None, method='auto', dtype=np.float64):
+    """Returns the positions and the maximum irradiance of all the images in
+    image_folder, sorted by position. Images whose filenames are not purely
+    numerical are ignored.
+
+    SYNTAX: posvals,maxvals = scan_max_irradiance(image_folder <,image_extension,
+                                                  nsmooth, processes, cache_file,
+                                                  method, dtype>);
+            <...> indicates optional arguments
+
+    image_folder    = relative or absolute path to the images directory
+    image_extension = filename extension of the images (default '.tif')
+    nsmooth         = number of pixels over which to smooth the images (default 32)
+    processes       = number of worker processes; None uses all cores, 1 runs serially
+    cache_file      = file in which results are stored between runs, e.g.
+                      'zscan_cache.json'; the default None turns caching off. If
+                      the file cannot be written the results are not cached.
+    method, dtype   = smoothing method and precision passed to get_image_max
+                      (default 'auto', np.float64)
+
+    A cached result is reused only if the image path, its modification time,
+    nsmooth, method and dtype are all unchanged. (method='auto' chooses from
+    nsmooth and the image size, which the key already fixes.)"""
+
+    posvals = []
+    paths = []
+    for fnameext in os.listdir(image_folder):
+        fname,fext = os.path.splitext(fnameext)
+        if fext!=image_extension:
+            continue
+        try:
+            posvals.append(float(fname))
+        except ValueError:                      # not a position, e.g. 'notes.tif'
+            continue
+        paths.append(os.path.abspath(os.path.join(image_folder, fnameext)))
+    posvals = np.array(posvals)
+    maxvals = np.empty(len(paths))              # preallocated, filled in below
+
+    with stage('load cache'):
+        cache = _load_cache(cache_file)
+
+    dtype = np.dtype(dtype).name
+    keys = [json.dumps([p, os.stat(p).st_mtime_ns, nsmooth, method, dtype]) for p in paths]
+    todo = []
+    for s,key in enumerate(keys):
+        if key in cache:
+            maxvals[s] = cache[key]
+        else:
+            todo.append(s)
+
+    jobs = [(s, paths[s], nsmooth, method, dtype) for s in todo]
+    if processes==1 or len(jobs)<2:
+        results = map(_image_max, jobs)
+        for s,maxval in results:
+            maxvals[s] = maxval
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for s,maxval in pool.imap_unordered(_image_max, jobs):
+                maxvals[s] = maxval
+
+    if cache_file is not None and todo:
+        for s in todo:
+            cache[keys[s]] = float(maxvals[s])
+        with stage('save cache'):
+            try:
+                _save_cache(cache_file, cache)
+            except OSError:                     # e.g. a read-only folder
+                pass
+
+    order = np.argsort(posvals)
+    return posvals[order],maxvals[order]
+
+def _image_max(job):
+    s,path,nsmooth,method,dtype = job
+    with stage('image',file=os.path.basename(path)): # recorded with processes=1
+        return s,get_image_max(path,nsmooth,dtype,method)
+
+def _load_cache(cache_file):
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as fid:
+            return json.load(fid)
+    except ValueError:                          # damaged cache: start over
+        return {}
+
+def _save_cache(cache_file, cache):
+    tmpfile = cache_file+'.tmp'                 # write, then rename, so a crash
+    with open(tmpfile,'w') as fid:              # never leaves a half-written cache
+        json.dump(cache, fid)
+    os.replace(tmpfile, cache_file)
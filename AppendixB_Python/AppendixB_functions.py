@@ -4,36 +4,59 @@
 # This file contains the Python functions for Appendix B in
 # "A First Course in Laboratory Optics" by A. Gretarsson. These are 
 # Python versions of the Matlab functions shown there.
+#
+# matplotlib is only imported by the functions that plot or read image files,
+# so the others can be used without it (and start up quickly, e.g. in worker
+# processes).
 
+import os
 import numpy as np
-import matplotlib.pyplot as plt
+import fft_backend as fftb
+from instrument import stage                # optional timing of the stages
 
-def beamradius(params,z):
+def beamradius(params,z,out=None):
     """Returns the field radius of a TEM_00 mode beam at any point z 
     along the optic axis. 
     
-    SYNTAX: w,R,zR = beamradius([w0,zw,lam],z);
+    SYNTAX: w,R,zR = beamradius([w0,zw,lam],z <,out=(w,R)>);
+            <...> indicates optional arguments
     
     w0 = waist size
     zw = position of waist
     lam = wavelength
     
     w  = spot size (field radius) at z
-    R  = curvature of phasefront at z
+    R  = curvature of phasefront at z (infinite at the waist)
     zR = Raleigh length.
     
     The input arguments w0, zw, lam, z all need to be in the same 
-    units. The output arguments will be in those units."""
+    units. The output arguments will be in those units. Any of them
+    may be arrays; they are broadcast against each other, so e.g. a
+    column of wavelengths and a row of z values gives w(lam,z).
+    
+    out = optional pair of preallocated float arrays of the broadcast 
+          shape into which w and R are written (no new arrays are made)."""
+    
+    w0=np.asarray(params[0])            # beam width at waist [e.g. meters]
+    zw=np.asarray(params[1])            # waist position [e.g. meters]
+    lam = np.asarray(params[2])         # wavelength [meters]
     
-    w0=params[0]                        # beam width at waist [e.g. meters]
-    zw=params[1]                        # waist position [e.g. meters]
-    lam = params[2]                     # wavelength [meters]
+    if out is None:
+        shape = np.broadcast_shapes(np.shape(w0),np.shape(zw),np.shape(lam),np.shape(z))
+        out = (np.empty(shape),np.empty(shape))
+    w,R = out
     
     zR=np.pi*w0**2/lam                  # Raleigh length [e.g. meters]
-    w=w0*np.sqrt(1+((z-zw)/zR)**2)      # beam width at z [e.g. meters]
-    R=z*(1+(zR/z)**2)                   # beam phasefront curvature at z
+    np.subtract(z,zw,out=R)             # distance from the waist, dz
+    np.divide(R,zR,out=w)
+    np.multiply(w,w,out=w)
+    np.add(w,1,out=w)
+    np.sqrt(w,out=w)
+    np.multiply(w,w0,out=w)             # beam width at z, w0*sqrt(1+(dz/zR)^2)
+    with np.errstate(divide='ignore'):  # at the waist R is infinite
+        np.add(R,zR**2/R,out=R)         # phasefront curvature at z, dz*(1+(zR/dz)^2)
 
-    return  w,R,zR                      # values at pos z [e.g. meters]
+    return  w[()],R[()],zR[()]          # values at pos z [e.g. meters]
 
 def prop(q1,abcd,mode=[0,0],p1=1):
     """Propagates a Gaussian beam (TEM_nm) with complex radius of 
@@ -47,72 +70,197 @@ def prop(q1,abcd,mode=[0,0],p1=1):
     SYNTAX: [q,p]=prop(q1,abcd <,[n,m],p1>);
             <...> indicates optional arguments
             
-    For a Hermite Gaussian n,m are the mode designators."""
+    For a Hermite Gaussian n,m are the mode designators.
+    
+    abcd may also be a stack of matrices with shape (...,2,2), e.g. the
+    output of abcd_chain() or abcd_free() called with a vector. The
+    leading dimensions of the stack are broadcast against q1, so one 
+    call propagates every q1 through every matrix in the stack."""
 
-    A=abcd[0][0]
-    B=abcd[0][1]
-    C=abcd[1][0]
-    D=abcd[1][1]
+    abcd = np.asarray(abcd)             # nested lists or (...,2,2) stacks
+    A=abcd[...,0,0]
+    B=abcd[...,0,1]
+    C=abcd[...,1,0]
+    D=abcd[...,1,1]
     
     n=mode[0]
     m=mode[1]
     
-    q = (A*q1 + B)/(C*q1 + D)
-    p = p1*np.exp(1j*np.angle(1/(A+B/q1)**(1+n+m)))
+    num = A*q1 + B                      # shared by q and p: A+B/q1 = num/q1
+    q = num/(C*q1 + D)
+    p = p1*np.exp(-1j*(1+n+m)*np.angle(num/q1))   # phase of 1/(num/q1)^(1+n+m)
     
     return q,p
 
-def q_(w,R,lam=1064.0e-9):
+def _abcd(A,B,C,D):
+    """Packs the (broadcastable) components A, B, C, D into a stack of
+    ABCD matrices with shape (...,2,2)."""
+    
+    A,B,C,D = np.broadcast_arrays(A,B,C,D)
+    M = np.empty(np.shape(A)+(2,2), dtype=np.result_type(A,B,C,D,float))
+    M[...,0,0]=A
+    M[...,0,1]=B
+    M[...,1,0]=C
+    M[...,1,1]=D
+    
+    return M
+
+def abcd_free(d):
+    """Returns the ABCD matrix of free space of length d.
+    
+    SYNTAX: M=abcd_free(d);
+    
+    d may be a scalar or an array, in which case M has shape 
+    np.shape(d)+(2,2)."""
+    
+    return _abcd(1,d,0,1)
+
+def abcd_lens(f):
+    """Returns the ABCD matrix of a thin lens of focal length f. 
+    f=np.inf corresponds to no lens.
+    
+    SYNTAX: M=abcd_lens(f);
+    
+    f may be a scalar or an array, in which case M has shape 
+    np.shape(f)+(2,2)."""
+    
+    with np.errstate(divide='ignore'):
+        return _abcd(1,0,-1/np.asarray(f,dtype=float),1)
+
+def abcd_mirror(R):
+    """Returns the ABCD matrix (on reflection) of a curved mirror with 
+    radius of curvature R. R>0 for a concave mirror, R=np.inf for a 
+    flat one.
+    
+    SYNTAX: M=abcd_mirror(R);
+    
+    R may be a scalar or an array, in which case M has shape 
+    np.shape(R)+(2,2)."""
+    
+    with np.errstate(divide='ignore'):
+        return _abcd(1,0,-2/np.asarray(R,dtype=float),1)
+
+def abcd_interface(n1,n2,R=np.inf):
+    """Returns the ABCD matrix of a spherical interface of radius of
+    curvature R going from index n1 to index n2. R=np.inf (default) 
+    gives a planar interface.
+    
+    SYNTAX: M=abcd_interface(n1,n2 <,R>);
+            <...> indicates optional arguments
+    
+    n1, n2 and R may be scalars or broadcastable arrays."""
+    
+    n1 = np.asarray(n1,dtype=float)
+    n2 = np.asarray(n2,dtype=float)
+    with np.errstate(divide='ignore'):
+        C = (n1-n2)/(n2*np.asarray(R,dtype=float))
+    return _abcd(1,0,C,n1/n2)
+
+def abcd_chain(elements,cumulative=False):
+    """Multiplies a chain of ABCD matrices together. elements is a list 
+    of matrices in the order the beam encounters them, i.e. 
+    abcd_chain([M1,M2,M3]) returns M3 @ M2 @ M1. 
+
+    SYNTAX: M=abcd_chain(elements <,cumulative>);
+            <...> indicates optional arguments
+
+    Each element may be a single 2x2 matrix or a stack with shape 
+    (...,2,2). The stacks are broadcast against each other, so e.g. 
+    a lens position scan is abcd_chain([abcd_free(z),abcd_lens(f),
+    abcd_free(L-z)]) with z a vector.
+
+    If cumulative=True the partial products after every element are 
+    returned instead, stacked along a new leading axis of length
+    len(elements). M[k] is then the system from the input up to and 
+    including element k."""
+
+    M = np.asarray(elements[0],dtype=float)
+    if not cumulative:
+        for E in elements[1:]:
+            M = np.asarray(E) @ M       # later elements multiply from the left
+        return M
+
+    partial = [M]
+    for E in elements[1:]:
+        M = np.asarray(E) @ M
+        partial.append(M)
+    shape = np.broadcast_shapes(*[np.shape(P) for P in partial])
+    return np.stack([np.broadcast_to(P,shape) for P in partial])
+
+def q_(w,R,lam=1064.0e-9,out=None):
     """Returns the q-factor of a Gaussian beam given the spot size, w,
     phasefront radius of curvature, R, and wavelength, lam.
 
-    SYNTAX: q=q_(w,R <,lam>);
+    SYNTAX: q=q_(w,R <,lam,out>);
                     <...> indicates optional arguments
 
     w     = 1/e Field radius 
-    R     = Radius of curvature of phasefront
+    R     = Radius of curvature of phasefront (np.inf for a flat one)
     lam   = wavelength 
+    out   = optional preallocated complex array into which q is written
 
-    w, R and lam must all be in the same units."""
+    w, R and lam must all be in the same units. They can be scalars 
+    or arrays of any broadcastable shapes, and R may be infinite for 
+    some elements only."""
 
-    if R!=np.inf:
-        q=np.pi*w**2*R/(np.pi*w**2-1j*R*lam)
-    else:
-        q=1j*np.pi*w**2/lam
+    # 1/q = 1/R - 1j*lam/(pi*w^2) holds element by element, including 
+    # R = inf (1/R = 0), so no special cases are needed.
+    w = np.asarray(w); R = np.asarray(R); lam = np.asarray(lam)
+    if out is None:
+        out = np.empty(np.broadcast_shapes(np.shape(w),np.shape(R),np.shape(lam)),complex)
+    with np.errstate(divide='ignore'):  # R = 0 gives q = 0
+        np.divide(1.0,R,out=out)
+        np.subtract(out,1j*lam/(np.pi*w**2),out=out)
+        np.divide(1.0,out,out=out)
+    q = out
 
-    return q
+    return q[()]
 
-def R_(q,lam=1064.0e-9):
+def R_(q,lam=1064.0e-9,out=None):
     """﻿Returns the phasefront radius of curvature, R, and the beam 
     width, w, of a Gaussian beam. Accepts the complex beam radius,
     q, and the wavelength. 
 
-    SYNTAX: R,w=R_(q <,lambda>);   
+    SYNTAX: R,w=R_(q <,lambda,out>);   
                 <...> indicates optional arguments
 
     q       = q-factor of the beam at the position where R and w are to
               be found. q can be a vector
     lam     = wavelength. Can be a vector or scalar.
+    out     = optional pair of preallocated float arrays (R,w) into 
+              which the results are written
     w       = beam radius
-    R       = beam phasefront curvature"""
-    
-    if np.real(q)!=0: # provided q isn't purely imaginary, use usual formulas
-        w = np.sqrt(lam/np.pi * np.imag(q)*(1+np.real(q)**2/np.imag(q)**2))
-        R=np.real(q)*(1+np.imag(q)**2/np.real(q)**2)*np.ones(np.shape(w))
-    else:             # if q is purely imaginary, R will be infinite
-        w = np.sqrt(lam/np.pi * np.imag(q)*(1+np.real(q)**2/np.imag(q)**2))
-        R = np.inf
+    R       = beam phasefront curvature (np.inf where q is purely 
+              imaginary)
+
+    q and lam are broadcast against each other, e.g. a column of 
+    wavelengths and a row of q values."""
+    
+    # With 1/q = 1/R - 1j*lam/(pi*w^2), R and w follow from the real and
+    # imaginary parts of 1/q, element by element.
+    qinv = 1/np.asarray(q,dtype=complex)
+    lam = np.asarray(lam)
+    if out is None:
+        shape = np.broadcast_shapes(np.shape(qinv),np.shape(lam))
+        out = (np.empty(shape),np.empty(shape))
+    R,w = out
+    
+    with np.errstate(divide='ignore'):  # if q is purely imaginary, R will be infinite
+        np.divide(1.0,qinv.real,out=R)
+    np.divide(-lam/np.pi,qinv.imag,out=w)
+    np.sqrt(w,out=w)
         
-    return R,w
+    return R[()],w[()]
     
-def imdespeckle(imagefile, threshold):
+def imdespeckle(imagefile, threshold, dtype=np.float64):
     """Performs a 2D fourier transform on the image in "imagefile", then sets to zero, all spatial 
     frequency bins with amplitude below the value given in  "threshold". The result is then 
     fourier transformed back to the spatial domain to produce the despeckled image. The beam 
     occupies a small part of the freq. domain image; speckle occupies the rest. Speckle has low 
     power per frequency bin. Suppressing all bins with low power therefore gets rid of speckle.
 
-    SYNTAX:  I = imdespeckle(imagefile, threshold);
+    SYNTAX:  I = imdespeckle(imagefile, threshold <,dtype>);
+             <...> indicates optional arguments
 
     NOTES: - threshold = 1 is usually a good starting point.
            - The image is assumed to be a monochrome image. If it's not, it's converted
@@ -121,26 +269,27 @@ def imdespeckle(imagefile, threshold):
     INPUT ARGUMENTS
     ---------------
     imagefile:    Full path and filename to the image (any format readable by "imread").
-    threshold:    Frequency components with log10(mag) below threshold are discarded."""
+    threshold:    Frequency components with log10(mag) below threshold are discarded.
+    dtype:        np.float64 (default) or np.float32. With np.float32 the image, its FFT
+                  (complex64) and the result use half the memory.
 
+    The computation is done by despeckle(), which does no plotting (and whose
+    stages are recorded by instrument.py when it is enabled)."""
 
-    data = plt.imread(imagefile);           # image is read into the array "data"
-    data = np.mean(data,2);                 # convert to greyscale
-    
-    # Perform the 2D numerical fourier transform and scale it correctly. The result is a
-    # picture of the image in "frequency space" (spatial frequency, that is).
-    N1 = np.shape(data)[0]                              # number of rows
-    N2 = np.shape(data)[1]                              # number of columns
-    F=np.fft.fftshift(np.fft.fft2(data)/np.sqrt(N1*N2)) # 2D FT with zero freq's in center
 
-    # Threshold the fourier transformed image
-    pixels_below_threshold = np.log10(np.abs(F))<threshold # logical mask for pixels -> 0
-    Fthresh = F                                         # start unthresholded
-    Fthresh[pixels_below_threshold] = 0                 # set pixels below threshold to 0                   
-    
-    # Finally, perform the inverse transform on the thresholded data to get back
-    # to position space. (I.e. to get back our image.).
-    despekld_image = np.abs(np.fft.ifft2(Fthresh)*np.sqrt(N1*N2))
+    import matplotlib.pyplot as plt
+
+    despekld_image,Fh = despeckle(imagefile, threshold, dtype, return_spectrum=True)
+
+    # Rebuild the full, centered and correctly scaled spectrum from the half spectrum
+    # returned by despeckle() (for display only).
+    N1,N2 = np.shape(despekld_image)                    # number of rows, columns
+    Fthresh = np.empty((N1,N2), dtype=Fh.dtype)
+    Fthresh[:,:N2//2+1] = Fh                            # non-negative column frequencies
+    rows = (-np.arange(N1))%N1                          # the rest follow from the symmetry
+    cols = N2-np.arange(N2//2+1,N2)                     # F(-k1,-k2) = conj(F(k1,k2)) of a
+    Fthresh[:,N2//2+1:] = np.conj(Fh[rows][:,cols])     # real image
+    Fthresh = fftb.fftshift(Fthresh)/(N1*N2)**0.5       # zero freq's in center, scaled
 
     # Now display the results
     plt.figure(1)                                       # open figure 1
@@ -162,4 +311,51 @@ def imdespeckle(imagefile, threshold):
     plt.show()
    
     return despekld_image
-    
\ No newline at end of file
+
+def despeckle(image, threshold, dtype=np.float64, return_spectrum=False):
+    """Computes the despeckled image exactly as imdespeckle() does, but without any 
+    plotting, so it can be used in scripts and batch jobs (see despeckle_batch.py).
+
+    SYNTAX:  I = despeckle(image, threshold <,dtype, return_spectrum>);
+             I,Fh = despeckle(image, threshold, dtype, True);
+             <...> indicates optional arguments
+
+    INPUT ARGUMENTS
+    ---------------
+    image:           Path to an image file, or the image itself as an array (greyscale,
+                     or colour with the colours along the third axis).
+    threshold:       Frequency components with log10(mag) below threshold are discarded.
+    dtype:           np.float64 (default) or np.float32.
+    return_spectrum: If True, the thresholded spectrum Fh is returned as well. Fh is the
+                     unscaled half spectrum produced by rfft2 (zero freq. at Fh[0,0]).
+
+    Because the greyscale image is real, only half of its spectrum is independent. It is
+    computed with rfft2, which takes about half the time and memory of fft2, and it is
+    thresholded in place."""
+
+    with stage('read'):
+        if isinstance(image,(str,os.PathLike)):
+            import matplotlib.image as mpimg
+            image = mpimg.imread(image)                 # image is read into an array
+    with stage('greyscale'):
+        data = np.asarray(image)
+        if np.ndim(data)==3:
+            data = np.mean(data,2,dtype=dtype)          # convert to greyscale
+        else:
+            data = data.astype(dtype,copy=False)
+    N1,N2 = np.shape(data)                              # number of rows, columns
+
+    # log10(|F|/sqrt(N1*N2)) < threshold is the same as |F| < 10^threshold*sqrt(N1*N2),
+    # which avoids taking a log and scaling every frequency bin.
+    with stage('fft',shape=(N1,N2)):
+        Fh = fftb.rfft2(data)                           # half of the 2D FT
+    with stage('threshold'):
+        Fh[np.abs(Fh) < 10.0**threshold*(N1*N2)**0.5] = 0 # threshold in place
+
+    with stage('ifft'):
+        despekld_image = fftb.irfft2(Fh, s=(N1,N2))     # back to position space
+        np.abs(despekld_image, out=despekld_image)
+
+    if return_spectrum:
+        return despekld_image,Fh
+    return despekld_image
@@ -0,0 +1,209 @@
+# angular_spectrum.py
+#
+# A second propagation engine for the ABCD systems of fft_propagation.py,
+# and a planner that picks between the two.
+#
+# The single-FFT Fresnel method (propagator.py) puts the result on a grid of
+# pitch dx = lam*B/(Nx*dxp). For short distances (small B) that grid is very
+# fine and covers only a small area, and the source chirp exp(1j*pi*A*xp^2/
+# (lam*B)) is undersampled unless the grid is made huge. The angular spectrum
+# method instead keeps the source grid (dx = dxp). Any ABCD matrix with B != 0
+# factors as
+#
+#   [A B; C D] = [1 0; (D-1)/B 1] @ [1 B; 0 1] @ [1 0; (A-1)/B 1],
+#
+# i.e. a thin lens, free space of length B and another thin lens, so the field
+# is multiplied by a chirp, convolved with the Fresnel kernel (one FFT, the
+# transfer function exp(-1j*pi*lam*B*(fx^2+fy^2)), one inverse FFT), and
+# multiplied by another chirp. The transfer function is band-limited to the
+# frequencies at which its phase is sampled finely enough (Matsushima and
+# Shimobaba, Opt. Express 17, 19662 (2009)), and the grid is zero-padded by
+# just enough that light spreading out of one side of the grid doesn't wrap
+# around into the other.
+#
+# Usage:   P,plan = make_propagator(Nx,Ny,dxp,dyp,lam,M)
+#          print(plan['method'],plan['accurate'])
+#          ufield = P(usource)          # on the grid P.x, P.y
+
+import numpy as np
+import fft_backend as fftb
+from propagator import get_propagator,trapz2,C,EPSILON0
+
+class AngularSpectrum:
+    """Band-limited angular spectrum propagator for a fixed sampling grid,
+    wavelength and ABCD matrix, with the same interface as Propagator. The
+    field plane grid is the source plane grid.
+
+    SYNTAX: P = AngularSpectrum(Nx,Ny,dxp,dyp,lam,abcd <,Npx,Npy,dtype>);
+            ufield = P(usource);
+            <...> indicates optional arguments
+
+    Nx, Ny   = number of pixels in the source plane grid
+    dxp, dyp = interpixel distance in the source plane
+    lam      = wavelength
+    abcd     = ABCD matrix of the optical system (B must not be 0)
+    Npx, Npy = size of the zero-padded grid used for the FFTs; the default is
+               the smallest that avoids wrap-around (see padded_size)
+    dtype    = np.complex128 (default) or np.complex64
+
+    usource may also be a stack of fields with shape (...,Ny,Nx). For even
+    Nx, Ny the field of Propagator (and fft_propagation.py) carries an extra
+    sign (-1)^(n+m) on pixel (m,n), since the source is not ifftshift'ed
+    before its FFT; this one does not. The intensities are the same."""
+
+    def __init__(self,Nx,Ny,dxp,dyp,lam,abcd,Npx=None,Npy=None,dtype=np.complex128):
+        AA,BB,CC,DD = np.ravel(np.asarray(abcd,dtype=float))
+        if BB==0:
+            raise ValueError('The angular spectrum method needs B != 0')
+        self.dtype = np.dtype(dtype)
+        rdtype = np.finfo(self.dtype).dtype
+        self.Nx = Nx; self.Ny = Ny
+        self.dxp = dxp; self.dyp = dyp
+        self.lam = lam
+        self.abcd = np.array([[AA,BB],[CC,DD]])
+        self.Npx = Npx or padded_size(Nx,dxp,lam,BB)
+        self.Npy = Npy or padded_size(Ny,dyp,lam,BB)
+        self.dx = dxp; self.dy = dyp
+
+        self.xp = (np.arange(0,Nx)-np.floor(Nx/2))*dxp
+        self.yp = (np.arange(0,Ny)-np.floor(Ny/2))*dyp
+        self.x = self.xp; self.y = self.yp
+
+        # Lens chirps before and after the free space B
+        cin = (AA-1)/BB; cout = (DD-1)/BB
+        self.src_chirp = np.outer(np.exp(1j*np.pi*cin*self.yp**2/lam),
+                                  np.exp(1j*np.pi*cin*self.xp**2/lam)).astype(self.dtype)
+        self.field_chirp = np.outer(np.exp(1j*np.pi*cout*self.y**2/lam),
+                                    np.exp(1j*np.pi*cout*self.x**2/lam)).astype(self.dtype)
+
+        # Band-limited Fresnel transfer function, separable in fx and fy
+        Hx = _transfer_function(self.Npx,dxp,lam,BB)
+        Hy = _transfer_function(self.Npy,dyp,lam,BB)
+        self.transfer = np.outer(Hy,Hx).astype(self.dtype)
+        for v in ('xp','yp','x','y'):
+            setattr(self,v,getattr(self,v).astype(rdtype))
+
+    def __call__(self,usource):
+        u = np.multiply(self.src_chirp,usource,dtype=self.dtype)
+        U = fftb.fft2(u,s=(self.Npy,self.Npx))         # zero-pads at the far ends
+        U *= self.transfer
+        u = fftb.ifft2(U)[...,:self.Ny,:self.Nx]
+        return u*self.field_chirp
+
+    def power(self,u,plane='field'):
+        """Returns the power carried by the field u (trapezoidal integral of
+        epsilon0*c/2*|u|^2); both planes have the same grid."""
+
+        return trapz2(EPSILON0*C/2*np.abs(u)**2)*self.dx*self.dy
+
+def _transfer_function(Np,dx,lam,B):
+    # exp(-1j*pi*lam*B*f^2), set to 0 above the frequency where its phase
+    # changes by more than pi between neighbouring samples df = 1/(Np*dx)
+    f = np.fft.fftfreq(Np,dx)
+    H = np.exp(-1j*np.pi*lam*B*f**2)
+    H[np.abs(f)>band_limit(Np,dx,lam,B)] = 0
+    return H
+
+def band_limit(Np,dx,lam,B):
+    """Returns the highest spatial frequency kept by the band-limited
+    transfer function on a padded grid of Np points: Np*dx/(2*lam*|B|), but
+    no more than the Nyquist frequency 1/(2*dx)."""
+
+    if B==0:
+        return 1/(2*dx)
+    return min(1/(2*dx),Np*dx/(2*lam*abs(B)))
+
+def padded_size(N,dx,lam,B):
+    """Returns the smallest fast FFT length Np >= N such that light within
+    the band limit, which spreads by lam*|B|*band_limit on each side, does
+    not wrap around into the N points kept. Np is never more than about 2*N.
+
+    SYNTAX: Np = padded_size(N,dx,lam,B);"""
+
+    Np = fftb.next_fast_len(N)
+    while True:
+        spread = lam*abs(B)*band_limit(Np,dx,lam,B)   # distance light moves sideways
+        need = N+int(np.ceil(spread/dx))
+        if need<=Np:
+            return Np
+        Np = fftb.next_fast_len(need)
+
+def plan_propagation(Nx,Ny,dxp,dyp,lam,abcd):
+    """Chooses between the single-FFT Fresnel method (Propagator) and the
+    band-limited angular spectrum method (AngularSpectrum) for a grid,
+    wavelength and ABCD matrix, and reports the sampling criteria.
+
+    SYNTAX: plan = plan_propagation(Nx,Ny,dxp,dyp,lam,abcd);
+
+    plan is a dictionary with
+    method   = 'fresnel' or 'angular', the cheaper of the accurate methods,
+               or if neither is accurate on this grid the one that is closest
+    accurate = whether the chosen method is accurate on this grid
+    fresnel, angular = dictionaries describing each method:
+        ratio    = how far the chirp applied to the source is from being
+                   undersampled at the grid edge (accurate if <= 1). It is
+                   |A|*N*dxp^2/(lam*|B|) for fresnel and |A-1|*N*dxp^2/(lam*|B|)
+                   for angular (worst of x and y).
+        accurate = ratio <= 1
+        shape    = (Ny,Nx) size of the FFTs, padded for angular
+        dx, dy   = field plane pixel size
+        cost     = relative cost, the number of FFT points times log2 of it,
+                   twice over for angular (forward and inverse)
+        bandwidth= (angular) fraction of the Nyquist band kept by the band
+                   limit, worst of x and y
+
+    For free space (A = 1) the angular spectrum method is accurate at any
+    distance, but the single FFT is cheaper once lam*B >= N*dxp^2."""
+
+    AA,BB,CC,DD = np.ravel(np.asarray(abcd,dtype=float))
+    L2 = max(Nx*dxp**2,Ny*dyp**2)                     # N*dxp^2 of the worst axis
+
+    plan = {}
+    if BB>0:
+        r = abs(AA)*L2/(lam*BB)
+        n = Nx*Ny
+        plan['fresnel'] = {'ratio': r, 'accurate': bool(r<=1), 'shape': (Ny,Nx),
+                           'dx': lam*BB/(Nx*dxp), 'dy': lam*BB/(Ny*dyp),
+                           'cost': n*np.log2(n)}
+    else:                                             # h = sqrt(B*lam) must be real
+        plan['fresnel'] = {'ratio': np.inf, 'accurate': False, 'shape': (Ny,Nx),
+                           'dx': np.nan, 'dy': np.nan, 'cost': np.inf}
+    if BB!=0:
+        r = abs(AA-1)*L2/(lam*abs(BB))
+        Npx = padded_size(Nx,dxp,lam,BB); Npy = padded_size(Ny,dyp,lam,BB)
+        n = Npx*Npy
+        plan['angular'] = {'ratio': r, 'accurate': bool(r<=1), 'shape': (Npy,Npx),
+                           'dx': dxp, 'dy': dyp, 'cost': 2*n*np.log2(n),
+                           'bandwidth': min(band_limit(Npx,dxp,lam,BB)*2*dxp,
+                                            band_limit(Npy,dyp,lam,BB)*2*dyp)}
+    else:
+        plan['angular'] = {'ratio': np.inf, 'accurate': False, 'shape': (Ny,Nx),
+                           'dx': dxp, 'dy': dyp, 'cost': np.inf, 'bandwidth': 0.0}
+
+    accurate = [m for m in ('fresnel','angular') if plan[m]['accurate']]
+    if accurate:
+        method = min(accurate,key=lambda m: plan[m]['cost'])
+    else:
+        method = min(('fresnel','angular'),key=lambda m: plan[m]['ratio'])
+    plan['method'] = method
+    plan['accurate'] = plan[method]['accurate']
+    return plan
+
+def make_propagator(Nx,Ny,dxp,dyp,lam,abcd,dtype=np.complex128):
+    """Returns the propagator chosen by plan_propagation, and the plan.
+
+    SYNTAX: P,plan = make_propagator(Nx,Ny,dxp,dyp,lam,abcd <,dtype>);
+            <...> indicates optional arguments
+
+    P is a (cached) Propagator or an AngularSpectrum; both are called as
+    P(usource) and give the field plane coordinates as P.x, P.y."""
+
+    plan = plan_propagation(Nx,Ny,dxp,dyp,lam,abcd)
+    if not np.isfinite(plan[plan['method']]['ratio']):
+        raise ValueError('B = 0: neither method applies to this system')
+    if plan['method']=='fresnel':
+        P = get_propagator(Nx,Ny,dxp,dyp,lam,abcd,dtype)
+    else:
+        Npy,Npx = plan['angular']['shape']
+        P = AngularSpectrum(Nx,Ny,dxp,dyp,lam,abcd,Npx,Npy,dtype)
+    return P,plan
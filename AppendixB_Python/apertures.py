@@ -0,0 +1,253 @@
+# apertures.py
+#
+# Apertures and obstructions for the source plane of fft_propagation.py.
+# Shapes are built from primitives (Circle, Rectangle, Slit, Polygon,
+# Grating) and combined with | (union), & (intersection) and ~ (complement,
+# i.e. an obstruction); .shift(dx,dy) moves a shape. For example the
+# off-center circular obstruction of fft_propagation.py is
+#
+#   aperture = ~Circle(50e-6).shift(-0.75*600e-6,0.35*600e-6)
+#   mask = aperture.mask(xp[0,:],yp[:,0])     # same as the logical mask there
+#
+# A shape is only evaluated inside its bounding box, and with antialias=n
+# only the pixels on its edges are subsampled (n x n) to give the fraction
+# of each pixel that is open. Masks are cached for each shape and grid, so
+# sweeps that come back to the same aperture don't recompute it; the cache
+# holds at most MASK_CACHE_BYTES of masks, dropping the least recently used.
+
+import collections
+import numpy as np
+
+MASK_CACHE_BYTES = 256*2**20            # total size of the masks kept in the cache
+
+class Shape:
+    """Base class of all apertures. Subclasses define inside(x,y), which
+    returns True where the points (x,y) are open, and the attributes
+    bbox = (xmin,xmax,ymin,ymax), outside of which inside() is everywhere
+    equal to the attribute outside (False for an aperture, True for an
+    obstruction), and key, a tuple that identifies the shape."""
+
+    outside = False
+
+    def __or__(self,other):
+        return Union(self,other)
+
+    def __and__(self,other):
+        return Intersection(self,other)
+
+    def __invert__(self):
+        return Complement(self)
+
+    def shift(self,dx,dy):
+        """Returns the shape moved by dx, dy."""
+        return Shifted(self,dx,dy)
+
+    def __eq__(self,other):
+        return isinstance(other,Shape) and self.key==other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def mask(self,x,y,antialias=1):
+        """Returns the mask of the shape on the grid with coordinate vectors
+        x (columns) and y (rows), both evenly spaced.
+
+        SYNTAX: m = shape.mask(x,y <,antialias>);
+                <...> indicates optional arguments
+
+        antialias = 1 (default): m is a logical array, True where the pixel
+                    centers are open
+                    n > 1: m is the open fraction of each pixel, estimated
+                    with n x n subsamples in the pixels on the edges
+
+        The mask is cached and shared, so it is read-only; use m.copy() to
+        get one that can be modified. The cache keeps the most recently used
+        masks, up to MASK_CACHE_BYTES (256 MB) in total: four logical masks
+        of 8192 x 8192, say. Masks larger than that, such as an antialiased
+        (float) 8192 x 8192 mask of 512 MB, are not cached."""
+
+        # The coordinates themselves are the cache key (as bytes, which are
+        # hashable), so the mask is evaluated at exactly the given points.
+        x = np.ascontiguousarray(x,dtype=float); y = np.ascontiguousarray(y,dtype=float)
+        key = (self,x.tobytes(),y.tobytes(),int(antialias))
+        m = _mask_cache.pop(key,None)
+        if m is None:
+            m = _make_mask(*key)
+            if m.nbytes>MASK_CACHE_BYTES:       # too large to keep
+                return m
+        _mask_cache[key] = m                    # now the most recently used
+        total = sum(v.nbytes for v in _mask_cache.values())
+        while total>MASK_CACHE_BYTES:
+            total -= _mask_cache.popitem(last=False)[1].nbytes
+        return m
+
+class Circle(Shape):
+    """Circular aperture of diameter d centered at (x0,y0)."""
+    def __init__(self,d,x0=0.0,y0=0.0):
+        self.d = d; self.x0 = x0; self.y0 = y0
+        self.bbox = (x0-d/2,x0+d/2,y0-d/2,y0+d/2)
+        self.key = ('Circle',d,x0,y0)
+
+    def inside(self,x,y):
+        return (x-self.x0)**2+(y-self.y0)**2 < (self.d/2)**2
+
+class Rectangle(Shape):
+    """Rectangular aperture of width w (along x) and height h centered at
+    (x0,y0). Either may be np.inf."""
+    def __init__(self,w,h,x0=0.0,y0=0.0):
+        self.w = w; self.h = h; self.x0 = x0; self.y0 = y0
+        self.bbox = (x0-w/2,x0+w/2,y0-h/2,y0+h/2)
+        self.key = ('Rectangle',w,h,x0,y0)
+
+    def inside(self,x,y):
+        return (np.abs(x-self.x0)<self.w/2) & (np.abs(y-self.y0)<self.h/2)
+
+def Slit(w,length=np.inf,x0=0.0,y0=0.0):
+    """Vertical slit of width w and length length (default infinite)."""
+    return Rectangle(w,length,x0,y0)
+
+class Polygon(Shape):
+    """Polygonal aperture with the corners (x,y) given as rows of vertices,
+    in order around the polygon. The polygon need not be convex."""
+    def __init__(self,vertices):
+        self.vertices = np.array(vertices,dtype=float)
+        vx,vy = self.vertices.T
+        self.bbox = (np.min(vx),np.max(vx),np.min(vy),np.max(vy))
+        self.key = ('Polygon',tuple(map(tuple,self.vertices.tolist())))
+
+    def inside(self,x,y):
+        # Even-odd rule: count the edges crossed by a ray from (x,y) in +x.
+        vx,vy = self.vertices.T
+        odd = np.zeros(np.broadcast_shapes(np.shape(x),np.shape(y)),dtype=bool)
+        for k in range(len(vx)):
+            x1,y1,x2,y2 = vx[k-1],vy[k-1],vx[k],vy[k]
+            if y1==y2:
+                continue
+            crosses = (y1>y)!=(y2>y)
+            xcross = x1+(y-y1)*(x2-x1)/(y2-y1)
+            odd ^= crosses & (x<xcross)
+        return odd
+
+def triangle(a):
+    """The equilateral triangular aperture of fft_propagation.py, i.e. the
+    region y<sqrt(3)*x+a/2/sqrt(3), y<-sqrt(3)*x+a/2/sqrt(3), y>-a/2/sqrt(3)."""
+    s = np.sqrt(3)
+    return Polygon([[-a/3,-a/2/s],[a/3,-a/2/s],[0,a/2/s]])
+
+class Grating(Shape):
+    """Amplitude grating of vertical slits with period period, of which the
+    fraction duty is open, covering a rectangle of width w and height h
+    centered at (x0,y0). One slit is centered on x0."""
+    def __init__(self,period,duty,w,h,x0=0.0,y0=0.0):
+        self.period = period; self.duty = duty
+        self.w = w; self.h = h; self.x0 = x0; self.y0 = y0
+        self.bbox = (x0-w/2,x0+w/2,y0-h/2,y0+h/2)
+        self.key = ('Grating',period,duty,w,h,x0,y0)
+
+    def inside(self,x,y):
+        phase = np.mod((x-self.x0)/self.period+self.duty/2,1)
+        return ((phase<self.duty) & (np.abs(x-self.x0)<self.w/2)
+                & (np.abs(y-self.y0)<self.h/2))
+
+class Shifted(Shape):
+    def __init__(self,shape,dx,dy):
+        self.shape = shape; self.dx = dx; self.dy = dy
+        b = shape.bbox
+        self.bbox = (b[0]+dx,b[1]+dx,b[2]+dy,b[3]+dy)
+        self.outside = shape.outside
+        self.key = ('Shifted',shape.key,dx,dy)
+
+    def inside(self,x,y):
+        return self.shape.inside(x-self.dx,y-self.dy)
+
+class Complement(Shape):
+    def __init__(self,shape):
+        self.shape = shape
+        self.bbox = shape.bbox
+        self.outside = not shape.outside
+        self.key = ('Complement',shape.key)
+
+    def inside(self,x,y):
+        return np.logical_not(self.shape.inside(x,y))
+
+def _bbox_union(a,b):
+    return (min(a[0],b[0]),max(a[1],b[1]),min(a[2],b[2]),max(a[3],b[3]))
+
+def _bbox_intersection(a,b):
+    return (max(a[0],b[0]),min(a[1],b[1]),max(a[2],b[2]),min(a[3],b[3]))
+
+class Union(Shape):
+    def __init__(self,a,b):
+        self.a = a; self.b = b
+        self.outside = a.outside or b.outside
+        if a.outside and b.outside:             # outside of either bbox it's open
+            self.bbox = _bbox_intersection(a.bbox,b.bbox)
+        elif a.outside or b.outside:            # open outside the obstruction's bbox
+            self.bbox = a.bbox if a.outside else b.bbox
+        else:
+            self.bbox = _bbox_union(a.bbox,b.bbox)
+        self.key = ('Union',a.key,b.key)
+
+    def inside(self,x,y):
+        return self.a.inside(x,y) | self.b.inside(x,y)
+
+class Intersection(Shape):
+    def __init__(self,a,b):
+        self.a = a; self.b = b
+        self.outside = a.outside and b.outside
+        if not a.outside and not b.outside:     # closed outside of either bbox
+            self.bbox = _bbox_intersection(a.bbox,b.bbox)
+        elif not a.outside or not b.outside:    # closed outside the aperture's bbox
+            self.bbox = b.bbox if a.outside else a.bbox
+        else:
+            self.bbox = _bbox_union(a.bbox,b.bbox)
+        self.key = ('Intersection',a.key,b.key)
+
+    def inside(self,x,y):
+        return self.a.inside(x,y) & self.b.inside(x,y)
+
+_mask_cache = collections.OrderedDict()   # (shape,x,y,antialias) -> mask, oldest first
+
+def _make_mask(shape,xbytes,ybytes,antialias):
+    x = np.frombuffer(xbytes); y = np.frombuffer(ybytes)
+    Nx = len(x); Ny = len(y)
+    dx = x[1]-x[0] if Nx>1 else 1.0
+    dy = y[1]-y[0] if Ny>1 else 1.0
+
+    # Index range of the pixels that touch the bounding box
+    xmin,xmax,ymin,ymax = shape.bbox
+    c0,c1 = _index_range(x[0],dx,Nx,xmin,xmax)
+    r0,r1 = _index_range(y[0],dy,Ny,ymin,ymax)
+
+    dtype = bool if antialias==1 else float
+    m = np.full((Ny,Nx),shape.outside,dtype=dtype)
+    if c1<=c0 or r1<=r0:
+        m.setflags(write=False)
+        return m
+    sub = shape.inside(x[None,c0:c1],y[r0:r1,None])
+
+    if antialias>1:
+        # Pixels whose center differs from a neighbour's lie on an edge; only
+        # those are subsampled. The bbox window is padded by one pixel so that
+        # edges on the window boundary are found too.
+        pad = np.pad(sub,1,mode='constant',constant_values=shape.outside)
+        edge = ((pad[1:-1,1:-1]!=pad[:-2,1:-1]) | (pad[1:-1,1:-1]!=pad[2:,1:-1])
+                | (pad[1:-1,1:-1]!=pad[1:-1,:-2]) | (pad[1:-1,1:-1]!=pad[1:-1,2:]))
+        sub = sub.astype(float)
+        i,j = np.nonzero(edge)
+        s = (np.arange(antialias)+0.5)/antialias-0.5  # subsample offsets, in pixels
+        sx,sy = np.meshgrid(s*dx,s*dy)
+        xs = x[c0+j][:,None]+np.ravel(sx)[None,:]
+        ys = y[r0+i][:,None]+np.ravel(sy)[None,:]
+        sub[i,j] = np.mean(shape.inside(xs,ys),axis=1)
+
+    m[r0:r1,c0:c1] = sub
+    m.setflags(write=False)
+    return m
+
+def _index_range(x0,dx,N,lo,hi):
+    # Indices of the grid points within one pixel of [lo,hi] (dx may be < 0)
+    a,b = sorted(((lo-x0)/dx,(hi-x0)/dx))
+    a = 0 if not np.isfinite(a) else int(np.clip(np.floor(a)-1,0,N))
+    b = N if not np.isfinite(b) else int(np.clip(np.ceil(b)+2,0,N))
+    return a,b
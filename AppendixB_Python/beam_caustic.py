@@ -0,0 +1,167 @@
+# beam_caustic.py
+#
+# Measures the beam quality factor M^2 from a stack of beam images taken at
+# different positions along the beam (a "caustic"). For every image the
+# beam centroid and its second moment (D4sigma) widths are found; the widths
+# are then fit with beamradius() to give the waist size w0, the waist
+# position zw and M^2 for each transverse direction, with uncertainties.
+#
+# As in max_irrad_vs_z.py, the image filenames are the positions at which
+# the images were taken. The images are processed in parallel.
+#
+# Usage:   res = measure_m2('sample_images', lam=633e-6, pixel=5.2e-3)
+#          print(res['x']['M2'], res['x']['M2_err'])
+
+import os
+import multiprocessing
+import numpy as np
+from scipy.optimize import curve_fit
+from AppendixB_functions import beamradius
+
+def beam_moments(A,background='border'):
+    """Returns the centroid and the second moment (D4sigma) beam radii of
+    the beam in image A, in pixels. The radius w = 2*sigma is the 1/e^2
+    intensity (1/e field) radius of a Gaussian beam, as used by beamradius.
+
+    SYNTAX: cx,cy,wx,wy = beam_moments(A <,background>);
+            <...> indicates optional arguments
+
+    A          = greyscale image, or a stack of images with shape (...,rows,cols)
+    background = 'border' (default): the mean of the outermost rows and
+                 columns is subtracted; a number: that value is subtracted;
+                 None: nothing is subtracted. Negative values are set to 0.
+    cx, cy     = column (x) and row (y) position of the centroid
+    wx, wy     = beam radii (2 sigma) along the columns and the rows"""
+
+    A = subtract_background(A,background)
+
+    # The moments of a 2D distribution along x and y only need its projections
+    # onto the two axes, so only two 1D sums over the image are required.
+    Px = np.sum(A,axis=-2)                              # projection onto x (columns)
+    Py = np.sum(A,axis=-1)                              # projection onto y (rows)
+    P = np.sum(Px,axis=-1)                              # total
+    x = np.arange(A.shape[-1]); y = np.arange(A.shape[-2])
+    cx = (Px@x)/P
+    cy = (Py@y)/P
+    wx = 2*np.sqrt((Px@x**2)/P-cx**2)
+    wy = 2*np.sqrt((Py@y**2)/P-cy**2)
+    return cx,cy,wx,wy
+
+def subtract_background(A,background='border'):
+    """Returns the image (or stack of images) A as floats with the
+    background subtracted and negative values set to 0; background is as in
+    beam_moments."""
+
+    A = np.asarray(A,dtype=float)
+    if background is not None:
+        if background=='border':
+            nb = 2*(A.shape[-1]+A.shape[-2])-4          # number of border pixels
+            background = (np.sum(A[...,0,:],-1) + np.sum(A[...,-1,:],-1)
+                          + np.sum(A[...,1:-1,0],-1) + np.sum(A[...,1:-1,-1],-1))/nb
+        A = np.maximum(A-np.asarray(background)[...,None,None],0)
+    return A
+
+def read_frame(file):
+    """Reads an image file and returns it as a greyscale float array (the
+    mean of the R, G and B values for colour images)."""
+
+    import matplotlib.image as mpimg            # only needed to read files
+    A = mpimg.imread(file)
+    if np.ndim(A)==3:
+        A = np.mean(A[:,:,0:3],2)                       # drop any alpha channel
+    return A
+
+def caustic_widths(image_folder,image_extension='.tif',background='border',processes=None):
+    """Finds the centroid and the D4sigma radii (see beam_moments) in every
+    image of image_folder whose filename is a number (the position).
+
+    SYNTAX: z,cx,cy,wx,wy = caustic_widths(image_folder <,image_extension,
+                                           background,processes>);
+            <...> indicates optional arguments
+
+    The outputs are vectors sorted by the position z, in pixels and the
+    units of the filenames. processes is the number of worker processes;
+    None uses all cores, 1 runs serially."""
+
+    z = []
+    jobs = []
+    for fnameext in os.listdir(image_folder):
+        fname,fext = os.path.splitext(fnameext)
+        if fext!=image_extension:
+            continue
+        try:
+            z.append(float(fname))
+        except ValueError:                              # not a position
+            continue
+        jobs.append((os.path.join(image_folder,fnameext),background))
+
+    if processes==1:
+        moments = list(map(_frame_moments,jobs))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            moments = pool.map(_frame_moments,jobs)
+
+    z = np.array(z)
+    order = np.argsort(z)
+    cx,cy,wx,wy = np.reshape(np.array(moments,dtype=float),(len(z),4))[order].T
+    return z[order],cx,cy,wx,wy
+
+def _frame_moments(job):
+    file,background = job
+    return beam_moments(read_frame(file),background)
+
+def fit_caustic(z,w,lam):
+    """Fits beam radii w measured at positions z to the radius of an
+    embedded Gaussian beam, i.e. beamradius([w0,zw,M2*lam],z), and returns
+    the waist size w0, the waist position zw and the beam quality M^2.
+
+    SYNTAX: p,perr = fit_caustic(z,w,lam);
+
+    p    = [w0, zw, M2]
+    perr = their uncertainties (from the covariance matrix of the fit,
+           scaled by the reduced chi-square since w has no error bars)
+
+    z, w and lam must all be in the same units. The starting point for
+    the fit is the exact solution of a parabola fit to w^2 versus z (the
+    ISO 11146 method)."""
+
+    z = np.asarray(z,dtype=float)
+    w = np.asarray(w,dtype=float)
+    c2,c1,c0 = np.polyfit(z,w**2,2)                     # w^2 = c0 + c1*z + c2*z^2
+    zw = -c1/(2*c2)
+    w0 = np.sqrt(max(c0-c1**2/(4*c2),np.min(w)**2/4))
+    M2 = max(np.pi*w0*np.sqrt(max(c2,0))/lam,1e-3)
+
+    def model(z,w0,zw,M2):
+        with np.errstate(divide='ignore',invalid='ignore'): # R is not used
+            return beamradius([w0,zw,M2*lam],z)[0]
+
+    p,pcov = curve_fit(model,z,w,p0=[w0,zw,M2])
+    p[0] = abs(p[0])                                    # w0 enters squared
+    return p,np.sqrt(np.diag(pcov))
+
+def measure_m2(image_folder,lam,pixel,zscale=1.0,image_extension='.tif',
+               background='border',processes=None):
+    """Measures w0, zw and M^2 in x and y from the beam images in image_folder.
+
+    SYNTAX: res = measure_m2(image_folder,lam,pixel <,zscale,image_extension,
+                             background,processes>);
+            <...> indicates optional arguments
+
+    lam    = wavelength
+    pixel  = size of a camera pixel
+    zscale = converts filename positions to the units of lam and pixel
+             (e.g. 1e-3 if the names are in microns and lam is in mm)
+
+    res is a dictionary with the vectors 'z', 'cx', 'cy', 'wx', 'wy' (in
+    the units of lam) and, for each of 'x' and 'y', a dictionary with the
+    entries 'w0', 'zw', 'M2' and their uncertainties 'w0_err', 'zw_err',
+    'M2_err'."""
+
+    z,cx,cy,wx,wy = caustic_widths(image_folder,image_extension,background,processes)
+    res = {'z': z*zscale, 'cx': cx*pixel, 'cy': cy*pixel, 'wx': wx*pixel, 'wy': wy*pixel}
+    for axis in ('x','y'):
+        p,perr = fit_caustic(res['z'],res['w'+axis],lam)
+        res[axis] = {'w0': p[0], 'zw': p[1], 'M2': p[2],
+                     'w0_err': perr[0], 'zw_err': perr[1], 'M2_err': perr[2]}
+    return res
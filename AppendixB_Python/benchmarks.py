@@ -0,0 +1,255 @@
+# benchmarks.py
+#
+# Times the computational hot paths of Appendix B (and get_image_max from
+# Appendix A) at realistic sizes, and keeps a history of the results so that
+# slowdowns are noticed. Everything runs offline on synthetic data. Each
+# result (best wall time of several runs, and peak memory allocated during
+# one run as seen by tracemalloc) is compared with the median of the last
+# few runs of the same case, size, FFT backend, precision and machine; the
+# script exits with status 1 if any of them got worse by more than the
+# threshold.
+#
+# The 'startup' case times how long a new Python process takes to import the
+# compute modules (as a pool worker must), and fails if that exceeds
+# --startup-budget or if any of them pulls in matplotlib.
+#
+# Run as a script, it puts AppendixA_Python on the path for the image_max
+# case; code that imports it and calls run_case() must do so itself.
+#
+# Usage:   python benchmarks.py                         # quick sizes
+#          python benchmarks.py --sizes full            # up to 8192^2 grids
+#          python benchmarks.py --backend numpy --precision single
+#          python benchmarks.py --cases fresnel chisqr --threshold 0.1
+
+import os
+import sys
+import json
+import time
+import subprocess
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APPENDIX_A = os.path.join(HERE,'..','AppendixA_Python')        # imageproc, for image_max
+
+import fft_backend as fftb
+
+HISTORY_FILE = os.path.join(HERE,'bench_history.json')
+THRESHOLD = 0.25                        # allowed relative slowdown / memory growth
+HISTORY_DEPTH = 5                       # past runs the baseline is the median of
+REPEAT = 3                              # timed runs per case (the best is kept)
+STARTUP_BUDGET = 1.5                    # s for a new process to import CORE_MODULES
+
+# The plotting-free compute modules; importing them must not load matplotlib
+CORE_MODULES = ['fft_backend','AppendixB_functions','propagator','apertures',
+                'angular_spectrum','zstack','outofcore','polychromatic','sweep',
+                'hg_modes','resonator','modematch','chisqr','resample',
+                'beam_caustic','profiles','despeckle_batch','imageproc','zscan']
+
+PRECISIONS = {'double': (np.float64,np.complex128), 'single': (np.float32,np.complex64)}
+
+# Each case is set up by a function setup(size,precision) that makes the
+# inputs and returns the function to be timed. Only that function is timed.
+
+def _setup_prop(n,precision):
+    from AppendixB_functions import prop
+    rdtype,cdtype = PRECISIONS[precision]
+    q1 = (np.linspace(-1,1,n)+1j).astype(cdtype)
+    abcd = np.array([[1,0.1],[-2,0.8]],dtype=rdtype)
+    return lambda: prop(q1,abcd,[1,2])
+
+def _setup_q_R_(n,precision):
+    from AppendixB_functions import q_,R_
+    rdtype = PRECISIONS[precision][0]
+    w = np.linspace(1e-4,1e-3,n).astype(rdtype)
+    R = np.linspace(-2,2,n).astype(rdtype)
+    return lambda: R_(q_(w,R))
+
+def _setup_beamradius(n,precision):
+    from AppendixB_functions import beamradius
+    rdtype = PRECISIONS[precision][0]
+    z = np.linspace(-1,1,n).astype(rdtype)
+    return lambda: beamradius([1e-4,0.1,1064e-9],z)
+
+def _setup_fresnel(N,precision):
+    # The source field and propagation of fft_propagation.py on an N x N grid
+    from propagator import Propagator
+    from apertures import triangle
+    cdtype = PRECISIONS[precision][1]
+    dxp = 0.004/(N-1)
+    M = np.array([[1,0.05],[0,1]])@np.array([[1,0],[1/0.03,1]])@np.array([[1,0.035],[0,1]])
+    P = Propagator(N,N,dxp,dxp,633e-9,M,cdtype)
+    r2 = P.xp[None,:]**2+P.yp[:,None]**2
+    usource = (np.exp(-r2/750e-6**2)*np.exp(1j*np.pi*r2/633e-9/0.5)).astype(cdtype)
+    usource *= triangle(3000e-6).mask(P.xp,P.yp)
+    def run():
+        u = P(usource)
+        return P.power(u)
+    return run
+
+def _setup_despeckle(n,precision):
+    # imdespeckle without the plotting, on n frames the size of sample_images
+    from AppendixB_functions import despeckle
+    rdtype = PRECISIONS[precision][0]
+    frames = _frames(n)
+    return lambda: [despeckle(A,-1.5,rdtype) for A in frames]
+
+def _setup_image_max(n,precision):
+    # get_image_max on n TIFF files like those in sample_images (decoding included)
+    from imageproc import get_image_max
+    import matplotlib.image as mpimg
+    rdtype = PRECISIONS[precision][0]
+    folder = tempfile.TemporaryDirectory()      # removed when run() is discarded
+    files = []
+    for k,A in enumerate(_frames(n)):
+        files.append(os.path.join(folder.name,str(k)+'.tif'))
+        mpimg.imsave(files[-1],A,format='tiff')
+    def run():
+        folder.name                             # keeps the folder alive
+        return [get_image_max(f,32,rdtype) for f in files]
+    return run
+
+def _setup_chisqr(n,precision):
+    # The chi-square surface of make_and_fit_data.py on an n x n mesh
+    from chisqr import chisqr_grid
+    rng = np.random.default_rng(0)
+    x = np.linspace(-5,5,9)
+    y = 0.51+0.0099*x+0.025*rng.standard_normal(9)
+    yerr = 0.02*np.abs(y)
+    a1 = np.linspace(0.4,0.6,n); a2 = np.linspace(0.008,0.012,n)
+    fitfunc = lambda x,a1,a2: a1+a2*x
+    return lambda: chisqr_grid(fitfunc,x,y,yerr,a1,a2)
+
+def _setup_startup(n,precision):
+    # A new interpreter importing the first n CORE_MODULES; the time includes
+    # the interpreter's own startup
+    code = ('import sys; sys.path[:0] = %r; import %s; '
+            "print('matplotlib' in sys.modules)"
+            % ([HERE,APPENDIX_A],','.join(CORE_MODULES[:n])))
+    def run():
+        out = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,check=True)
+        if out.stdout.split()[-1]=='True':
+            raise RuntimeError('Importing the compute modules loads matplotlib')
+    return run
+
+def _frames(n):
+    # n speckled, Gaussian-spot RGB frames of 1024 x 1280 pixels (uint8)
+    rng = np.random.default_rng(0)
+    yy,xx = np.mgrid[0:1024,0:1280]
+    frames = []
+    for k in range(n):
+        spot = 200*np.exp(-((xx-640-3*k)**2+(yy-512)**2)/(2*80.0**2))
+        A = np.clip(spot*rng.exponential(1.0,spot.shape)+10,0,255).astype(np.uint8)
+        frames.append(np.repeat(A[:,:,None],3,axis=2))
+    return frames
+
+# name: (setup, quick sizes, full sizes)
+CASES = {'prop':       (_setup_prop,      [10**4,10**6],     [10**4,10**6,10**7]),
+         'q_R_':       (_setup_q_R_,      [10**4,10**6],     [10**4,10**6,10**7]),
+         'beamradius': (_setup_beamradius,[10**4,10**6],     [10**4,10**6,10**7]),
+         'fresnel':    (_setup_fresnel,   [256,1024],        [256,512,1024,2048,4096,8192]),
+         'despeckle':  (_setup_despeckle, [2],               [20,100]),
+         'image_max':  (_setup_image_max, [2],               [20,100]),
+         'chisqr':     (_setup_chisqr,    [100,316],         [100,316,1000]),
+         'startup':    (_setup_startup,   [len(CORE_MODULES)],[len(CORE_MODULES)])}
+
+def run_case(name,size,precision='double',repeat=REPEAT):
+    """Times one case and returns its record: the best of repeat wall times
+    (s) and the peak memory (MB) traced during one extra run."""
+
+    setup = CASES[name][0]
+    func = setup(size,precision)
+    times = []
+    for k in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'case': name, 'size': size, 'precision': precision,
+            'backend': fftb.get_backend()[0], 'host': platform.node(),
+            'time': min(times), 'peak_mb': peak/2**20,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def baseline(history,record,depth=HISTORY_DEPTH):
+    """Returns the median time and peak memory of the last depth runs in
+    history with the same case, size, precision, backend and host as
+    record, or None if there are none."""
+
+    key = ('case','size','precision','backend','host')
+    past = [h for h in history if all(h[k]==record[k] for k in key)][-depth:]
+    if not past:
+        return None
+    return {'time': float(np.median([h['time'] for h in past])),
+            'peak_mb': float(np.median([h['peak_mb'] for h in past]))}
+
+def load_history(history_file):
+    if history_file and os.path.exists(history_file):
+        with open(history_file) as fid:
+            return json.load(fid)
+    return []
+
+def save_history(history_file,history):
+    tmp = history_file+'.tmp'
+    with open(tmp,'w') as fid:
+        json.dump(history,fid,indent=1)
+    os.replace(tmp,history_file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Appendix B hot paths.')
+    parser.add_argument('--cases',nargs='+',default=list(CASES),choices=list(CASES))
+    parser.add_argument('--sizes',default='quick',choices=['quick','full'])
+    parser.add_argument('--precision',default='double',choices=list(PRECISIONS))
+    parser.add_argument('--backend',default='auto',help='FFT backend (see fft_backend.py)')
+    parser.add_argument('--workers',type=int,default=-1)
+    parser.add_argument('--threshold',type=float,default=THRESHOLD,
+                        help='allowed relative increase of time or memory')
+    parser.add_argument('--startup-budget',type=float,default=STARTUP_BUDGET,
+                        help='max. time (s) for a new process to import the compute modules')
+    parser.add_argument('--repeat',type=int,default=REPEAT)
+    parser.add_argument('--history',default=HISTORY_FILE,help='JSON history file')
+    parser.add_argument('--no-save',action='store_true',help="don't add the results to the history")
+    args = parser.parse_args(argv)
+
+    fftb.set_backend(args.backend,args.workers)
+    history = load_history(args.history)
+    new = []
+    failed = []
+    over_budget = []
+    print('%-11s %10s %10s %10s %8s' % ('case','size','time (s)','peak (MB)','change'))
+    for name in args.cases:
+        sizes = CASES[name][1] if args.sizes=='quick' else CASES[name][2]
+        for size in sizes:
+            rec = run_case(name,size,args.precision,args.repeat)
+            base = baseline(history,rec)
+            change = ''
+            if base is not None:
+                dt = rec['time']/base['time']-1
+                dm = rec['peak_mb']/base['peak_mb']-1 if base['peak_mb']>1 else 0.0 # < 1 MB is noise
+                change = '%+7.1f%%' % (100*dt)
+                if dt>args.threshold or dm>args.threshold:
+                    failed.append((rec,base))
+                    change += ' !'
+            if name=='startup' and rec['time']>args.startup_budget:
+                over_budget.append(rec)
+                change += ' !'
+            print('%-11s %10d %10.4g %10.1f %8s' % (name,size,rec['time'],rec['peak_mb'],change))
+            new.append(rec)
+
+    if not args.no_save:
+        save_history(args.history,history+new)
+    for rec,base in failed:
+        print('REGRESSION %s %d: %.4g s (was %.4g s), %.1f MB (was %.1f MB)'
+              % (rec['case'],rec['size'],rec['time'],base['time'],rec['peak_mb'],base['peak_mb']))
+    for rec in over_budget:
+        print('OVER BUDGET startup: %.3g s (budget %.3g s)' % (rec['time'],args.startup_budget))
+    return 1 if failed or over_budget else 0
+
+if __name__ == '__main__':
+    sys.path.append(APPENDIX_A)
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# chisqr.py
+#
+# Chi-square surfaces, profiles and Delta-chi-square = 1 intervals for the
+# fits in make_and_fit_data.py. Instead of calling ChiSqr once per point,
+# the fit function is evaluated on a whole block of parameter values at a
+# time. The blocks are sized to stay within a memory budget, so surfaces
+# with millions of points can be computed without running out of memory.
+#
+# The fit function must work with arrays, i.e. fitfunc(x,a1,a2,...) must
+# broadcast x against the parameters, as fitfunc in make_and_fit_data.py does.
+
+import numpy as np
+
+MEM_BUDGET = 64*2**20                   # bytes of residuals held at any one time
+
+def chisqr_grid(fitfunc,x,y,yerr,*axes,mem_budget=MEM_BUDGET):
+    """Returns the chi-square of the fit of fitfunc to the data (x,y,yerr)
+    at every point of the parameter grid spanned by the vectors in axes.
+
+    SYNTAX: X2 = chisqr_grid(fitfunc,x,y,yerr,a_1,a_2,... <,mem_budget=...>);
+            <...> indicates optional arguments
+
+    a_1, a_2, ... = values of the 1st, 2nd, ... fit parameter. A parameter
+                    can be held fixed by giving a single value, e.g. [a[1]].
+    X2            = array of shape (len(a_1),len(a_2),...); X2[i,j,...] is
+                    the chi-square at a_1[i], a_2[j], ... (note that this is
+                    the transpose of the np.meshgrid(a_1,a_2) layout)
+    mem_budget    = max. number of bytes used for residuals at any one time"""
+
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    yerr = np.asarray(yerr,dtype=float)
+    axes = [np.atleast_1d(np.asarray(a,dtype=float)) for a in axes]
+    shape = tuple(len(a) for a in axes)
+    npts = int(np.prod(shape))
+    X2 = np.empty(npts)
+
+    chunk = max(1,int(mem_budget//(3*8*len(x)))) # residuals and two temporaries
+    for start in range(0,npts,chunk):
+        idx = np.unravel_index(np.arange(start,min(start+chunk,npts)),shape)
+        params = [a[i][:,None] for a,i in zip(axes,idx)] # one column per grid point
+        wr = (fitfunc(x,*params)-y)/yerr        # weighted residuals, (chunk,len(x))
+        X2[start:start+len(idx[0])] = np.einsum('ij,ij->i',wr,wr)
+
+    return X2.reshape(shape)
+
+def grid_profile(X2,axis):
+    """Returns the profile of the chi-square surface X2 (from chisqr_grid)
+    along one parameter: for each value of that parameter, the minimum of
+    X2 over all the other parameters.
+
+    SYNTAX: X2prof = grid_profile(X2,axis);"""
+
+    others = tuple(k for k in range(np.ndim(X2)) if k!=axis)
+    return np.min(X2,axis=others)
+
+def chisqr_profile(fitfunc,x,y,yerr,a,axis,values):
+    """Returns the profile chi-square of one fit parameter. For every value
+    in values the parameter is held fixed and the chi-square is minimized
+    over all the other parameters. Each minimization starts from the
+    solution of the previous one, beginning at the best fit a.
+
+    SYNTAX: X2prof,aprof = chisqr_profile(fitfunc,x,y,yerr,a,axis,values);
+
+    a      = best fit parameters (e.g. from curve_fit)
+    axis   = index of the parameter to profile
+    values = values of that parameter
+    X2prof = the profile chi-square at each value
+    aprof  = the parameters (including the fixed one) that minimize it"""
+
+    from scipy.optimize import least_squares    # slow to import, only needed here
+
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    yerr = np.asarray(yerr,dtype=float)
+    a = np.array(a,dtype=float)
+    free = [k for k in range(len(a)) if k!=axis]
+    X2prof = np.empty(len(values))
+    aprof = np.empty((len(values),len(a)))
+
+    def residuals(afree,afixed):
+        p = np.empty(len(a))
+        p[free] = afree
+        p[axis] = afixed
+        return (fitfunc(x,*p)-y)/yerr
+
+    def walk(order,afree):
+        for s in order:
+            if free:
+                afree = least_squares(residuals,afree,args=(values[s],)).x
+            aprof[s,free] = afree
+            aprof[s,axis] = values[s]
+            X2prof[s] = np.sum(residuals(afree,values[s])**2)
+
+    # Start at the value nearest the best fit and work outwards in both
+    # directions, so that every fit starts next to its own solution.
+    start = int(np.argmin(np.abs(np.asarray(values)-a[axis])))
+    walk(range(start,len(values)),a[free])
+    walk(range(start-1,-1,-1),aprof[start,free])
+
+    return X2prof,aprof
+
+def delta_chisqr_interval(values,X2prof,delta=1.0):
+    """Returns the range of a parameter over which its (profile) chi-square
+    lies within delta (default 1) of its minimum, i.e. the usual 1 sigma
+    confidence interval when delta=1. The edges are found by linear
+    interpolation between grid points. An edge is NaN if the chi-square
+    doesn't rise by delta within the range of values.
+
+    SYNTAX: lo,hi = delta_chisqr_interval(values,X2prof <,delta>);
+            <...> indicates optional arguments"""
+
+    values = np.asarray(values,dtype=float)
+    X2prof = np.asarray(X2prof,dtype=float)
+    level = np.min(X2prof)+delta
+    imin = int(np.argmin(X2prof))
+    inside = X2prof<=level
+
+    edges = []
+    for step in (-1,1):                         # walk down, then up, from the minimum
+        s = imin
+        while 0<=s+step<len(values) and inside[s+step]:
+            s += step
+        if not 0<=s+step<len(values):
+            edges.append(np.nan)
+            continue
+        s1,s2 = s,s+step                        # crossing lies between these
+        t = (level-X2prof[s1])/(X2prof[s2]-X2prof[s1])
+        edges.append(values[s1]+t*(values[s2]-values[s1]))
+
+    return edges[0],edges[1]
+
+def delta_chisqr_contour(a_1,a_2,X2,delta=1.0):
+    """Returns the contour(s) on which the 2D chi-square surface X2 (from
+    chisqr_grid) equals its minimum plus delta (default 1).
+
+    SYNTAX: lines = delta_chisqr_contour(a_1,a_2,X2 <,delta>);
+            <...> indicates optional arguments
+
+    lines = list of arrays of shape (npts,2); each row is one (a_1,a_2)
+            point on the contour. Closed contours end at their start."""
+
+    import contourpy                            # comes with matplotlib
+    gen = contourpy.contour_generator(np.asarray(a_1),np.asarray(a_2),np.transpose(X2))
+    return gen.lines(np.min(X2)+delta)
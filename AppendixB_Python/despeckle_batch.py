@@ -0,0 +1,66 @@
+# despeckle_batch.py
+#
+# Despeckles every image in a directory without any plotting. The images are
+# shared out over a pool of worker processes and each result is written to
+# disk (as a .npy file named after the image, e.g. 12.5.tif.npy) as soon as
+# it is finished, so thousands of camera frames can be cleaned in one
+# unattended run.
+#
+# Usage:   for infile,outfile in despeckle_dir('frames','clean',1.0):
+#              print(outfile)
+
+import os
+import multiprocessing
+import numpy as np
+import fft_backend as fftb
+from AppendixB_functions import despeckle
+
+IMAGE_EXTENSIONS = ('.tif','.tiff','.jpg','.jpeg','.png')
+
+def despeckle_dir(indir, outdir, threshold, dtype=np.float32, processes=None,
+                  extensions=IMAGE_EXTENSIONS, overwrite=False):
+    """Despeckles all images in the directory indir (see despeckle() in
+    AppendixB_functions.py) and writes the results to outdir. This is a
+    generator: it yields (infile, outfile) for each image as soon as its
+    result has been written, in order of completion.
+
+    SYNTAX: for infile,outfile in despeckle_dir(indir, outdir, threshold <,dtype,
+                                                processes, extensions, overwrite>):
+            <...> indicates optional arguments
+
+    indir      = directory containing the images
+    outdir     = directory for the results (created if necessary)
+    threshold  = frequency components with log10(mag) below threshold are discarded
+    dtype      = np.float32 (default) or np.float64
+    processes  = number of worker processes; None uses all cores, 1 runs serially
+    extensions = filename extensions of the images to process
+    overwrite  = if False (default), images whose result already exists are skipped
+
+    The result for the image a.tif is written to outdir/a.tif.npy."""
+
+    os.makedirs(outdir, exist_ok=True)
+    jobs = []
+    for fnameext in sorted(os.listdir(indir)):
+        fname,fext = os.path.splitext(fnameext)
+        if fext.lower() not in extensions:
+            continue
+        outfile = os.path.join(outdir, fnameext+'.npy')  # a.tif and a.jpg kept apart
+        if overwrite or not os.path.exists(outfile):
+            jobs.append((os.path.join(indir,fnameext), outfile, threshold, dtype))
+
+    if processes==1:
+        for job in jobs:
+            yield _despeckle_file(job)
+        return
+
+    # Each process does one image at a time, so the FFTs inside it are kept
+    # single threaded to avoid oversubscribing the cores.
+    with multiprocessing.Pool(processes, initializer=fftb.set_backend,
+                              initargs=(fftb.get_backend()[0],1)) as pool:
+        for result in pool.imap_unordered(_despeckle_file, jobs):
+            yield result
+
+def _despeckle_file(job):
+    infile,outfile,threshold,dtype = job
+    np.save(outfile, despeckle(infile, threshold, dtype))
+    return infile,outfile
@@ -0,0 +1,120 @@
+# fft_backend.py
+#
+# Selects the library used for the FFTs in the Fourier optics and image
+# processing functions. scipy.fft can spread one transform over several
+# threads ("workers") and pyFFTW can additionally reuse plans and FFTW
+# wisdom between runs. NumPy's np.fft is always available and is used as
+# the fallback. All backends give the same results to within rounding.
+#
+# Usage:   import fft_backend as fftb
+#          fftb.set_backend('scipy', workers=8)
+#          F = fftb.fftshift(fftb.fft2(A))
+
+import os
+import pickle
+import numpy as np
+
+fftshift = np.fft.fftshift              # the shifts are plain index rolls, no
+ifftshift = np.fft.ifftshift            # transform library is needed for them
+
+# The library is loaded on first use, so importing this module is cheap
+_state = {'name': None, 'module': None, 'workers': -1, 'wisdom_file': None}
+
+def set_backend(name='auto',workers=-1,wisdom_file=None):
+    """Chooses the FFT library used by fft, fft2, ifft2, rfft2 and irfft2.
+
+    SYNTAX: set_backend(<name, workers, wisdom_file>);
+            <...> indicates optional arguments
+
+    name        = 'numpy', 'scipy', 'pyfftw' or 'auto' (default). 'auto'
+                  picks scipy if it can be imported and numpy otherwise.
+    workers     = number of threads per transform; -1 (default) uses all
+                  cores. Ignored by the numpy backend.
+    wisdom_file = (pyfftw only) file from which FFTW wisdom is loaded, if it
+                  exists, and to which save_wisdom() writes it."""
+
+    if name=='auto':
+        try:
+            import scipy.fft
+            name = 'scipy'
+        except ImportError:
+            name = 'numpy'
+
+    if name=='numpy':
+        module = np.fft
+    elif name=='scipy':
+        import scipy.fft as module
+    elif name=='pyfftw':
+        import pyfftw
+        import pyfftw.interfaces.scipy_fft as module
+        pyfftw.interfaces.cache.enable()        # keep FFTW plans between calls
+        if workers is not None and workers<0:   # pyfftw wants an explicit count
+            workers = os.cpu_count()+1+workers
+        if wisdom_file is not None and os.path.exists(wisdom_file):
+            with open(wisdom_file,'rb') as fid:
+                pyfftw.import_wisdom(pickle.load(fid))
+    else:
+        raise ValueError("Unknown FFT backend '"+str(name)+"'")
+
+    _state.update(name=name,module=module,workers=workers,wisdom_file=wisdom_file)
+
+def get_backend():
+    """Returns the name of the current FFT backend and its number of workers.
+
+    SYNTAX: name,workers = get_backend();"""
+
+    if _state['module'] is None:
+        set_backend()
+    return _state['name'],_state['workers']
+
+def save_wisdom(wisdom_file=None):
+    """Writes the FFTW wisdom gathered so far to wisdom_file (default: the
+    file given to set_backend) so that later runs can skip the planning.
+    Does nothing unless the pyfftw backend is active.
+
+    SYNTAX: save_wisdom(<wisdom_file>);
+            <...> indicates optional arguments"""
+
+    wisdom_file = wisdom_file or _state['wisdom_file']
+    if _state['name']!='pyfftw' or wisdom_file is None:
+        return
+    import pyfftw
+    with open(wisdom_file,'wb') as fid:
+        pickle.dump(pyfftw.export_wisdom(),fid)
+
+def next_fast_len(n):
+    """Returns the smallest length >= n for which the FFT is fast (a product
+    of small primes with scipy, otherwise the next power of two)."""
+    try:
+        import scipy.fft
+        return scipy.fft.next_fast_len(int(n))
+    except ImportError:
+        return int(2**np.ceil(np.log2(n)))
+
+def _call(fname,a,**kwargs):
+    if _state['module'] is None:
+        set_backend()                   # the fastest available library
+    func = getattr(_state['module'],fname)
+    if _state['name']=='numpy':
+        return func(a,**kwargs)
+    return func(a,workers=_state['workers'],**kwargs)
+
+def fft(a,n=None,axis=-1):
+    """1D FFT along one axis of a, using the current backend."""
+    return _call('fft',a,n=n,axis=axis)
+
+def fft2(a,s=None,axes=(-2,-1)):
+    """2D FFT over the last two axes of a, using the current backend."""
+    return _call('fft2',a,s=s,axes=axes)
+
+def ifft2(a,s=None,axes=(-2,-1)):
+    """2D inverse FFT over the last two axes of a, using the current backend."""
+    return _call('ifft2',a,s=s,axes=axes)
+
+def rfft2(a,s=None,axes=(-2,-1)):
+    """2D FFT of a real array (half spectrum), using the current backend."""
+    return _call('rfft2',a,s=s,axes=axes)
+
+def irfft2(a,s=None,axes=(-2,-1)):
+    """Inverse of rfft2, using the current backend."""
+    return _call('irfft2',a,s=s,axes=axes)
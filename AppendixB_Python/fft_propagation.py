@@ -12,6 +12,9 @@
 import numpy as np
 import numpy.matlib as npm
 import matplotlib.pyplot as plt
+import fft_backend as fftb                          # FFT library (numpy, scipy or pyfftw)
+from apertures import triangle                      # aperture shapes
+import instrument as ins                            # optional timing of the FFT (INSTRUMENT=1)
 
 # --------------------
 # Physical Parameters
@@ -49,24 +52,22 @@ AA = M[0,0]; BB = M[0,1]; CC = M[1,0]; DD = M[1,1]; # The components A, B, C, D
 # Field amplitude is non-zero at these values of x, y (i.e. where it passes 
 # through the aperture). The apertures are defined as logical matrixes that 
 # are used to index the source field distribution, i.e. Usource(~aperture)=0;
-# UIsource(aperture)= <something nonzero>.
+# UIsource(aperture)= <something nonzero>. They are built from the shapes in
+# apertures.py: combine them with | (or), & (and), ~ (not, for obstructions)
+# and move them with .shift(dx,dy).
 
+#from apertures import Circle
 #a = 50*1e-6;                                        # circular obstrution diam. (m)
 #b = 600e-6;                                         # off-center scale factor
-#aperture = (xp+0.75*b)**2+(yp-0.35*b)**2 > (a/2)**2 # circular obstruction logical mask
+#aperture = (~Circle(a).shift(-0.75*b,0.35*b)).mask(xp[0,:],yp[:,0]) # circular obstruction logical mask
 
 a = 3000*1e-6;                                      # triangle side length (m)
-aperture = np.logical_and.reduce([(yp<np.sqrt(3)*xp+a/2/np.sqrt(3)), \
-            (yp<-np.sqrt(3)*xp+a/2/np.sqrt(3)), \
-            (yp>-a/2/np.sqrt(3))])                  # equil. triangular aperture
+aperture = triangle(a).mask(xp[0,:],yp[:,0])        # equil. triangular aperture
 
 
 #a = 300e-6                                          # triangle side length (m)
 #b = 600e-6                                          # off-center scale factor
-#aperture = np.logical_not(np.logical_and.reduce(\
-#           [((yp-0.35*b)<np.sqrt(3)*(xp+0.75*b)+a/2/np.sqrt(3)), \
-#           ((yp-0.35*b)<-np.sqrt(3)*(xp+0.75*b)+a/2/np.sqrt(3)), \
-#           ((yp-0.35*b)>-a/2/np.sqrt(3))]))         # equil. triangular aperture        # equil. triangular obstruction
+#aperture = (~triangle(a).shift(-0.75*b,0.35*b)).mask(xp[0,:],yp[:,0]) # equil. triangular obstruction
 
 # -------------
 # Source Field 
@@ -108,9 +109,10 @@ x = X*h;  y = Y*h;                                  # Field plane, x and y-domai
 
 # Perform 2D FFT on and scale correctly
 # -------------------------------------
-ufield = \
-    -1j*np.exp(1j*np.pi*DD/BB/lam*((x)**2+(y)**2)) \
-    *np.fft.fftshift(np.fft.fft2(np.exp(1j*np.pi*AA*(Xp**2+Yp**2))*usource )*dXp*dYp ) # FT2
+with ins.stage('fft'):
+    ufield = \
+        -1j*np.exp(1j*np.pi*DD/BB/lam*((x)**2+(y)**2)) \
+        *fftb.fftshift(fftb.fft2(np.exp(1j*np.pi*AA*(Xp**2+Yp**2))*usource )*dXp*dYp ) # FT2
 Ifield = epsilon0*c/2*np.abs(ufield)**2;            # get the intensity
 
 # ========================================================================================
@@ -123,6 +125,7 @@ inpow =  np.trapz(np.trapz(Isource))*dxp*dxp;		# integral of intensity in the sr
 outpow = np.trapz(np.trapz(Ifield))*dx*dy;			# (total power) should equal field plane
 print('Power in the source plane:   Pin  =  '+"%8.4f" % ( inpow*1000)+' mW');
 print('Power in the field plane:   Pout  =  '+"%8.4f" % (outpow*1000)+' mW');
+ins.report()                                        # time spent in the FFT, if enabled
 
 # Display source plane intensity (Fig. 1)
 # ---------------------------------------
@@ -0,0 +1,218 @@
+# frame_stream.py
+#
+# Processes camera images while a measurement is running, instead of after
+# the whole folder has been recorded. A folder is watched for new image
+# files (the camera, or whoever copies its frames, drops them there). Each
+# new file is decoded and converted to greyscale once, and the frame is
+# handed to several analysis stages (despeckling, smoothed peak, centroid and
+# D4sigma widths, a cut through the image) that run in their own threads, so
+# all of them see the same image. The results for each frame are returned as
+# soon as all its stages are done.
+#
+# The queues between the reader and the stages are bounded: if a stage falls
+# behind, the reader waits, and new files simply stay on disk until there is
+# room, so memory use does not grow during a long scan.
+#
+# The default stages use image_max from imageproc.py in AppendixA_Python,
+# which must be importable, e.g. after
+#   sys.path.append('../AppendixA_Python')
+#
+# Usage:   z = []; w = []
+#          for res in stream_frames('scan_folder',timeout=60):
+#              z.append(res['position']); w.append(res['moments'][2])
+#              plt.cla(); plt.plot(z,w,'o'); plt.pause(0.01)  # caustic so far
+
+import os
+import time
+import queue
+import threading
+import functools
+import numpy as np
+from AppendixB_functions import despeckle
+from beam_caustic import beam_moments
+from profiles import greyscale,moving_mean
+
+IMAGE_EXTENSIONS = ('.tif','.tiff','.jpg','.jpeg')
+POLL = 0.5                              # s between looks at the folder
+MAXQUEUE = 4                            # frames waiting per stage
+
+def watch_folder(folder,extensions=IMAGE_EXTENSIONS,poll=POLL,timeout=None,existing=True,
+                 stop=None):
+    """Yields the paths of image files as they appear in folder, oldest
+    first. A file is only yielded once its size has stopped changing between
+    two looks at the folder, so half-written files are not read.
+
+    SYNTAX: for path in watch_folder(folder <,extensions,poll,timeout,existing,stop>):
+            <...> indicates optional arguments
+
+    poll     = time between looks at the folder in s
+    timeout  = stop after this many seconds without a new file (default
+               None: never stop)
+    existing = if True (default) files already in the folder are yielded
+               first; if False only files that appear later
+    stop     = optional threading.Event; the watch ends when it is set"""
+
+    seen = set()
+    sizes = {}                                  # size of each new file at the last look
+    if not existing:
+        seen.update(_list_images(folder,extensions))
+    last_new = time.monotonic()
+    while True:
+        ready = []
+        for path in _list_images(folder,extensions):
+            if path in seen:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:                     # removed in the meantime
+                continue
+            if sizes.get(path)==st.st_size and st.st_size>0:
+                ready.append((st.st_mtime_ns,path))
+            sizes[path] = st.st_size
+        for mtime,path in sorted(ready):
+            seen.add(path)
+            del sizes[path]
+            last_new = time.monotonic()
+            yield path
+        if timeout is not None and time.monotonic()-last_new>timeout:
+            return
+        if stop is not None and stop.wait(poll):
+            return
+        elif stop is None:
+            time.sleep(poll)
+
+def _list_images(folder,extensions):
+    return [os.path.join(folder,f) for f in os.listdir(folder)
+            if os.path.splitext(f)[1].lower() in extensions]
+
+def default_stages(threshold=-1.5,nsmooth=32,nsoft=10):
+    """Returns the standard analysis stages, a dictionary {name: function}
+    in which each function takes the greyscale frame:
+
+    despeckle = the despeckled image (see despeckle in AppendixB_functions)
+    peak      = (maximum, (row,col)) of the image smoothed over nsmooth
+                pixels, as in get_image_max (which averages only R and G
+                for greyscale, so for colour images its values differ)
+    moments   = (cx,cy,wx,wy), centroid and D4sigma radii in pixels (see
+                beam_moments)
+    cut       = (cut,softcut), the vertical cut through the image center and
+                its nsoft pixel moving mean, as in image_cut.py
+
+    The peak stage needs imageproc (AppendixA_Python) on the path."""
+
+    from imageproc import image_max
+    return {'despeckle': functools.partial(despeckle,threshold=threshold),
+            'peak': functools.partial(image_max,n=nsmooth,return_location=True),
+            'moments': beam_moments,
+            'cut': functools.partial(_center_cut,nsoft=nsoft)}
+
+def _center_cut(A,nsoft):
+    cut = A[:,round(np.shape(A)[1]/2)]
+    softcut = moving_mean(cut,nsoft)
+    return cut,softcut
+
+def stream_frames(folder,stages=None,extensions=IMAGE_EXTENSIONS,poll=POLL,timeout=None,
+                  existing=True,maxqueue=MAXQUEUE):
+    """Watches folder for new images and yields the results of the analysis
+    stages for each of them, in the order the files arrived.
+
+    SYNTAX: for res in stream_frames(folder <,stages,extensions,poll,timeout,
+                                     existing,maxqueue>):
+            <...> indicates optional arguments
+
+    stages   = dictionary {name: function(A)} of analyses to run on every
+               frame A (greyscale, the mean of R, G and B, read-only); the
+               default is default_stages()
+    maxqueue = number of frames that may wait for each stage
+    poll, timeout, existing, extensions: see watch_folder
+
+    res is a dictionary with
+    index    = number of the frame, counting from 0
+    file     = path of the image file
+    position = the filename as a number (e.g. the z position), or None
+    and the result of each stage under its name. An exception raised by a
+    stage is raised again here. Stopping the loop early stops the threads."""
+
+    stages = default_stages() if stages is None else stages
+    names = list(stages)
+    inboxes = {name: queue.Queue(maxqueue) for name in names}
+    results = queue.Queue(maxqueue*len(names))
+    stop = threading.Event()
+
+    def put(q,item):                            # blocks until there is room, or stop
+        while not stop.is_set():
+            try:
+                q.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for k,path in enumerate(watch_folder(folder,extensions,poll,timeout,existing,stop)):
+                import matplotlib.image as mpimg
+                A = greyscale(mpimg.imread(path))       # each file is decoded once
+                A.setflags(write=False)                 # and shared by the stages
+                for name in names:
+                    if not put(inboxes[name],(k,path,A)):
+                        return
+        except Exception as err:
+            put(results,(None,'reader',err))
+        for name in names:
+            put(inboxes[name],None)                     # no more frames
+
+    def worker(name):
+        func = stages[name]
+        while True:
+            try:
+                item = inboxes[name].get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                continue
+            if item is None:
+                put(results,(None,name,None))           # this stage is finished
+                return
+            k,path,A = item
+            try:
+                out = func(A)
+            except Exception as err:
+                out = err
+            if not put(results,(k,name,(path,out))):
+                return
+
+    threads = [threading.Thread(target=reader,daemon=True)]
+    threads += [threading.Thread(target=worker,args=(name,),daemon=True) for name in names]
+    for t in threads:
+        t.start()
+
+    pending = {}                                # frame index -> results so far
+    nextk = 0
+    finished = 0
+    try:
+        while finished<len(names):
+            k,name,item = results.get()
+            if k is None:
+                if isinstance(item,Exception):
+                    raise item
+                finished += 1
+                continue
+            path,out = item
+            if isinstance(out,Exception):
+                raise out
+            res = pending.setdefault(k,{'index': k,'file': path,'position': _position(path)})
+            res[name] = out
+            while nextk in pending and all(n in pending[nextk] for n in names):
+                yield pending.pop(nextk)
+                nextk += 1
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+def _position(path):
+    try:
+        return float(os.path.splitext(os.path.basename(path))[0])
+    except ValueError:
+        return None
@@ -0,0 +1,70 @@
+# hg_modes.py
+#
+# Decomposes a sampled field, such as usource or ufield in fft_propagation.py,
+# into Hermite-Gauss modes HG_nm (the TEM_nm modes of prop()). The 2D modes
+# are products u_n(x)*u_m(y) of 1D Hermite-Gauss functions, so all the
+# overlap integrals are obtained from two matrix products with the 1D
+# basis instead of one full 2D integral per mode. The 1D basis functions are
+# generated with a stable recurrence and cached for each grid and beam.
+
+import functools
+import numpy as np
+
+BASIS_CACHE_SIZE = 16                   # number of 1D bases kept in the cache
+
+@functools.lru_cache(maxsize=BASIS_CACHE_SIZE)
+def hg_basis(nmax,N,dx,w,R,lam):
+    """Returns the normalized 1D Hermite-Gauss functions u_0 ... u_nmax
+    sampled at the N points x = (arange(N)-floor(N/2))*dx, the grid used in
+    fft_propagation.py. Results are cached, so don't modify them.
+
+    SYNTAX: B = hg_basis(nmax,N,dx,w,R,lam);
+
+    w   = 1/e field radius of the beam
+    R   = radius of curvature of its phasefront (np.inf for a waist)
+    lam = wavelength
+    B   = complex array of shape (nmax+1,N), B[n] = u_n(x)
+
+    The sum over x of |u_n|^2*dx is 1. The phasefront curvature enters as
+    exp(1j*pi*x^2/(lam*R)), the convention of usource in fft_propagation.py."""
+
+    x = (np.arange(N)-np.floor(N/2))*dx
+    xi = np.sqrt(2)*x/w                 # u_n(x) = sqrt(sqrt(2)/w)*psi_n(xi)
+
+    # Hermite functions psi_n(xi) = H_n(xi)*exp(-xi^2/2)/sqrt(2^n n! sqrt(pi)) by
+    # the recurrence psi_{n+1} = sqrt(2/(n+1))*xi*psi_n - sqrt(n/(n+1))*psi_{n-1}.
+    # Unlike H_n itself, these stay of order 1, so high orders don't overflow.
+    psi = np.empty((nmax+1,N))
+    psi[0] = np.pi**-0.25*np.exp(-xi**2/2)
+    if nmax>0:
+        psi[1] = np.sqrt(2)*xi*psi[0]
+    for n in range(1,nmax):
+        psi[n+1] = np.sqrt(2/(n+1))*xi*psi[n] - np.sqrt(n/(n+1))*psi[n-1]
+
+    B = np.sqrt(np.sqrt(2)/w)*psi*np.exp(1j*np.pi*x**2/(lam*R))
+    B.setflags(write=False)             # shared by all users of the cache
+    return B
+
+def hg_decompose(u,dx,dy,w,R,lam,nmax):
+    """Projects the field u onto the Hermite-Gauss modes HG_nm with
+    n,m = 0 ... nmax, for a beam of radius w and phasefront curvature R.
+
+    SYNTAX: c,P,Prest = hg_decompose(u,dx,dy,w,R,lam,nmax);
+
+    u      = field sampled on the grid of fft_propagation.py, shape (Ny,Nx)
+             with x along the columns (e.g. usource, with dx = dxp)
+    c      = mode amplitudes, c[n,m] = sum(conj(u_n(x)*u_m(y))*u)*dx*dy
+    P      = fraction of the power of u in each mode, |c|^2/sum(|u|^2)/dx/dy
+    Prest  = fraction of the power not in any of the modes, 1-sum(P)
+
+    Only the relative phases of the modes in c depend on the Gouy phase,
+    which is left out of the basis, so P does not."""
+
+    Ny,Nx = np.shape(u)
+    Bx = hg_basis(nmax,Nx,float(dx),float(w),float(R),float(lam))
+    By = hg_basis(nmax,Ny,float(dy),float(w),float(R),float(lam))
+    c = (np.conj(Bx)@np.transpose(u)@np.conj(By).T)*dx*dy # c[n,m], n along x
+
+    Ptot = np.sum(np.abs(u)**2)*dx*dy
+    P = np.abs(c)**2/Ptot
+    return c,P,1-np.sum(P)
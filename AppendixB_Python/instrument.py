@@ -0,0 +1,169 @@
+# instrument.py
+#
+# Optional timing and memory instrumentation of the stages of a computation
+# (grid build, chirps, FFT, power check, image decoding, smoothing, ...).
+# Code marks its stages with
+#
+#   with stage('fft'):
+#       ...
+#
+# When instrumentation is off (the default) stage() returns a shared do-
+# nothing context manager, so the marks cost next to nothing. When it is on,
+# every stage that finishes adds a record (a dictionary) with its name, its
+# path of enclosing stages, the wall time and, optionally, the peak memory
+# allocated inside it (tracemalloc) and the peak resident set size of the
+# process so far. Turn it on from code with enable(), or for a whole run by
+# setting the environment variable INSTRUMENT to 1 (times only) or memory:
+#
+#   INSTRUMENT=memory python fft_propagation.py
+#
+# Records made in worker processes (multiprocessing) stay in those processes;
+# use processes=1 to see the stages of every item. Stages may run in several
+# threads at once (e.g. frame_stream.py); each thread nests its own stages.
+# tracemalloc only sees the memory of the whole process, so the peak memory
+# of a stage then includes what other threads allocated at the same time.
+#
+# The modules of AppendixA_Python (imageproc, zscan) use it when
+# AppendixB_Python is on the path, and otherwise run without it.
+
+import os
+import sys
+import time
+import threading
+import contextlib
+import tracemalloc
+
+try:
+    import resource                     # peak RSS; not available on Windows
+except ImportError:
+    resource = None
+
+_state = {'enabled': False, 'memory': False, 'sink': None, 'records': []}
+_NULL = contextlib.nullcontext()
+_local = threading.local()              # the stack of open stages of each thread
+_open = []                              # open stages of all threads (memory tracing)
+_lock = threading.Lock()
+
+def enable(memory=False,sink=None):
+    """Turns instrumentation on.
+
+    SYNTAX: enable(<memory,sink>);
+            <...> indicates optional arguments
+
+    memory = if True, the peak memory allocated in each stage is traced with
+             tracemalloc (this slows down code that allocates many small
+             objects, but not large array operations)
+    sink   = function called with each record as it is made, e.g. print"""
+
+    _state.update(enabled=True,memory=memory,sink=sink)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    """Turns instrumentation off. The records made so far are kept."""
+    if _state['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state.update(enabled=False,memory=False)
+
+def enabled():
+    """Returns True if instrumentation is on."""
+    return _state['enabled']
+
+def stage(name,**info):
+    """Returns a context manager that records the time (and memory) spent in
+    the block it encloses as the stage name. Any keyword arguments are added
+    to the record, e.g. stage('fft',shape=(1024,1024))."""
+
+    if not _state['enabled']:
+        return _NULL
+    return _Stage(name,info)
+
+def records(clear=False):
+    """Returns the list of stage records, in the order the stages finished.
+    With clear=True the list is emptied.
+
+    Each record has the entries
+    stage     = name of the stage
+    path      = names of the enclosing stages and this one, joined by '/'
+    time      = wall time in s
+    peak_mb   = (memory tracing only) peak memory allocated in the stage, MB
+    maxrss_mb = peak resident set size of the process so far, MB
+    and any keyword arguments given to stage()."""
+
+    recs = list(_state['records'])
+    if clear:
+        _state['records'].clear()
+    return recs
+
+def summary(recs=None):
+    """Returns {path: {'count', 'time', 'peak_mb'}} with the number of
+    times each stage ran, its total time and its largest peak memory."""
+
+    out = {}
+    for r in (records() if recs is None else recs):
+        s = out.setdefault(r['path'],{'count': 0, 'time': 0.0, 'peak_mb': None})
+        s['count'] += 1
+        s['time'] += r['time']
+        if 'peak_mb' in r:
+            s['peak_mb'] = max(s['peak_mb'] or 0.0,r['peak_mb'])
+    return out
+
+def report(recs=None,file=None):
+    """Prints summary() as a table. Does nothing if there are no records."""
+    s = summary(recs)
+    if not s:
+        return
+    file = file or sys.stdout
+    print('%-40s %6s %10s %10s' % ('stage','count','time (s)','peak (MB)'),file=file)
+    for path,v in s.items():
+        peak = '' if v['peak_mb'] is None else '%10.1f' % v['peak_mb']
+        print('%-40s %6d %10.4g %10s' % (path,v['count'],v['time'],peak),file=file)
+
+class _Stage:
+    def __init__(self,name,info):
+        self.name = name
+        self.info = info
+
+    def __enter__(self):
+        if not hasattr(_local,'stack'):
+            _local.stack = []
+        stack = _local.stack
+        if _state['memory']:
+            # tracemalloc has a single peak; hand the peak so far to all the
+            # open stages (of every thread) before resetting it for this one
+            with _lock:
+                current,peak = tracemalloc.get_traced_memory()
+                for s in _open:
+                    s.peak = max(s.peak,peak)
+                tracemalloc.reset_peak()
+                self.start = current
+                self.peak = current
+                _open.append(self)
+        stack.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        dt = time.perf_counter()-self.t0
+        stack = _local.stack
+        stack.pop()
+        rec = {'stage': self.name, 'path': '/'.join([s.name for s in stack]+[self.name]),
+               'time': dt}
+        if _open:
+            with _lock:
+                if self in _open:
+                    _open.remove(self)
+                    if tracemalloc.is_tracing():
+                        peak = max(self.peak,tracemalloc.get_traced_memory()[1])
+                        rec['peak_mb'] = (peak-self.start)/2**20
+        if resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            rec['maxrss_mb'] = rss/2**20 if sys.platform=='darwin' else rss/2**10
+        rec.update(self.info)
+        _state['records'].append(rec)
+        if _state['sink'] is not None:
+            _state['sink'](rec)
+        return False
+
+if os.environ.get('INSTRUMENT','') not in ('','0'):
+    enable(memory=os.environ['INSTRUMENT'].lower()=='memory')
@@ -11,6 +11,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
+from chisqr import chisqr_grid             # evaluates chi-square on whole parameter grids
 
 #-------------------------------------------------------------------
 # Functions used in script 
@@ -92,12 +93,8 @@ for s in range(len(a)):
 
 a_1 = np.linspace(0.4,0.6,200)              # The domain of a_1-axis chi-square cut
 a_2 = np.linspace(0.005,0.015,200)          # The domain of a_2-axis chi-square cut
-X2_a1cut = np.zeros(len(a_1))               # will hold the y-values of the a_1 cut
-X2_a2cut = np.zeros(len(a_2))               # will hold the y-values of the a_2 cut
-for s in range(len(a_1)):
-    X2_a1cut[s] = ChiSqr([a_1[s],a[1]],fitfunc,x,y,yerr) # the a_1 cut chi-square values 
-for s in range(len(a_1)):
-    X2_a2cut[s] = ChiSqr([a[0],a_2[s]],fitfunc,x,y,yerr) # the a_2 cut chi-square values
+X2_a1cut = chisqr_grid(fitfunc,x,y,yerr,a_1,[a[1]])[:,0] # the a_1 cut chi-square values
+X2_a2cut = chisqr_grid(fitfunc,x,y,yerr,[a[0]],a_2)[0,:] # the a_2 cut chi-square values
 
 plt.figure(2)                               # Open a figure in which to plot
 plt.clf()                                   # Remove any previous plots
@@ -130,10 +127,10 @@ plt.show()
 # Set up the domain. a1 and a2 are matrixes of parameter values at which to calculate chi-squared
 a1,a2 = np.meshgrid(np.linspace(0.47,0.55,100),np.linspace(-0.01,0.03,100)) 
 
-X2 = np.zeros(np.shape(a1))      # This is the surface we will be finding
-for k in range(np.shape(a1)[0]):                     # step through all the values of a1 and a2
-    for s in range(np.shape(a2)[1]):                 # in the desired range
-        X2[k,s] = ChiSqr([a1[k,s],a2[k,s]],fitfunc,x,y,yerr) # Uses ChiSqr function def. above
+# This is the surface we will be finding. chisqr_grid gives the same values as calling
+# ChiSqr (def. above) at every point, but for all points at once. Its rows follow the
+# first parameter, so it is transposed to match the layout of a1 and a2 from meshgrid.
+X2 = chisqr_grid(fitfunc,x,y,yerr,a1[0,:],a2[:,0]).T
 
 
 fig3 = plt.figure(3)                                # open figure 2
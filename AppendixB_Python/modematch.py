@@ -0,0 +1,101 @@
+# modematch.py
+#
+# Finds two-lens telescopes that mode-match a Gaussian beam into a target
+# mode (e.g. the eigenmode of a cavity, see resonator.py, or the mode of a
+# fiber). Every pair of focal lengths from a catalogue of available lenses
+# is tried at every pair of positions on a grid, all at once; the best
+# candidates are then refined and ranked by how well they match and by how
+# tolerant the match is to errors in the lens positions.
+#
+# All positions are measured from the plane where the input beam has the
+# complex beam radius q_in; the target mode is specified at z = L.
+
+import numpy as np
+from scipy.optimize import minimize
+
+def overlap(q1,q2):
+    """Returns the power coupling (mode overlap) between two TEM_00 beams
+    with complex beam radii q1 and q2 at the same plane. 1 means a perfect
+    match. q1 and q2 may be broadcastable arrays.
+
+    SYNTAX: eta = overlap(q1,q2);"""
+
+    return 4*np.imag(q1)*np.imag(q2)/np.abs(np.conj(q2)-q1)**2
+
+def two_lens_q(q_in,f1,f2,z1,z2,L):
+    """Returns q at z = L of a beam with q = q_in at z = 0 after thin lenses
+    of focal lengths f1 at z1 and f2 at z2. This is prop() through
+    [free(z1), lens(f1), free(z2-z1), lens(f2), free(L-z2)], written out
+    element by element so that large arrays of f1, f2, z1, z2 are cheap.
+
+    SYNTAX: q = two_lens_q(q_in,f1,f2,z1,z2,L);"""
+
+    q = q_in + z1                       # free space: q -> q + d
+    q = q/(1-q/f1)                      # thin lens: q -> q/(1 - q/f)
+    q = q + (z2-z1)
+    q = q/(1-q/f2)
+    return q + (L-z2)
+
+def mode_match(q_in,q_target,L,focal_lengths,z1_range,z2_range,npos=100,
+               nbest=10,dz=1e-3,min_sep=0.0):
+    """Searches for two-lens solutions that map q_in at z = 0 onto q_target
+    at z = L.
+
+    SYNTAX: sols = mode_match(q_in,q_target,L,focal_lengths,z1_range,z2_range
+                              <,npos,nbest,dz,min_sep>);
+            <...> indicates optional arguments
+
+    focal_lengths = available focal lengths (each may be used for either lens)
+    z1_range      = (min,max) allowed position of the first lens
+    z2_range      = (min,max) allowed position of the second lens
+    npos          = number of grid positions tried in each range (default 100)
+    nbest         = number of lens pairs refined and returned (default 10)
+    dz            = position error used to judge the tolerance (default 1e-3,
+                    i.e. 1 mm if lengths are in meters)
+    min_sep       = minimum distance between the lenses (default 0)
+
+    sols is a list of dictionaries with the entries 'f1', 'f2', 'z1', 'z2',
+    'eta' (overlap with the target mode) and 'eta_worst' (the lowest overlap
+    when either lens is moved by +/-dz). It is sorted by eta_worst, so the
+    first solution is the best one that is also easy to set up.
+    All lengths in the same units."""
+
+    f = np.asarray(focal_lengths,dtype=float)
+    z1 = np.linspace(z1_range[0],z1_range[1],npos)[:,None]
+    z2 = np.linspace(z2_range[0],z2_range[1],npos)[None,:]
+    allowed = z2-z1>=min_sep
+
+    # Brute force: one lens pair per row of 'best', all positions at once.
+    # Looping over the first lens keeps the memory at len(f)*npos^2 values.
+    best = np.empty((len(f),len(f)))
+    where = np.empty((len(f),len(f)),dtype=int)
+    for i in range(len(f)):
+        with np.errstate(divide='ignore',invalid='ignore'):
+            eta = overlap(two_lens_q(q_in,f[i],f[:,None,None],z1,z2,L),q_target)
+        eta = np.where(allowed & np.isfinite(eta),eta,0)
+        eta = np.reshape(eta,(len(f),-1))
+        where[i] = np.argmax(eta,axis=1)
+        best[i] = eta[np.arange(len(f)),where[i]]
+
+    # Refine the positions of the best lens pairs locally
+    sols = []
+    for k in np.argsort(best,axis=None)[::-1][:nbest]:
+        i,j = np.unravel_index(k,best.shape)
+        s1,s2 = np.unravel_index(where[i,j],(npos,npos))
+        f1,f2 = f[i],f[j]
+
+        def mismatch(z):
+            if z[1]-z[0]<min_sep:
+                return 1.0
+            return 1-overlap(two_lens_q(q_in,f1,f2,z[0],z[1],L),q_target)
+
+        opt = minimize(mismatch,[z1[s1,0],z2[0,s2]],method='Nelder-Mead',
+                       bounds=[z1_range,z2_range],options={'xatol':dz/100,'fatol':1e-12})
+        zz1,zz2 = opt.x
+        shifts = np.array([[dz,0],[-dz,0],[0,dz],[0,-dz]])
+        eta_worst = np.min(overlap(two_lens_q(q_in,f1,f2,zz1+shifts[:,0],zz2+shifts[:,1],L),q_target))
+        sols.append({'f1': f1, 'f2': f2, 'z1': zz1, 'z2': zz2,
+                     'eta': 1-opt.fun, 'eta_worst': eta_worst})
+
+    sols.sort(key=lambda s: -s['eta_worst'])
+    return sols
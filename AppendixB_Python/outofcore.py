@@ -0,0 +1,164 @@
+# outofcore.py
+#
+# The propagation of fft_propagation.py for grids too large for memory
+# (16k x 16k and up, where a single complex128 field is 4 GB or more). The
+# 2-D FFT is done in three passes over files on disk (np.memmap's), each
+# with one band or block in memory at a time, so the memory in use is set by
+# tile_bytes rather than the grid size:
+#
+#   1. the source field is built a band of rows at a time (so it never exists
+#      in full), multiplied by the source chirp, FFT'd along its rows and
+#      written to a work file;
+#   2. the work file is transposed into a second one, one square block at a
+#      time;
+#   3. the rows of the transposed file (the columns of the field) are read a
+#      band at a time, FFT'd, multiplied by the field plane chirp, and
+#      written to the output file column by column.
+#
+# Every pass reads and writes runs of at least a block width (tile_bytes
+# permitting, a whole number of memory pages). The transpose finishes each
+# band of its output before starting the next, and the work file is read
+# without read-ahead, so that each file is read and written only once even
+# when it is much larger than memory. (Reading bands of columns straight from
+# the row-ordered work file instead reads a short piece of every row; on a
+# 16k grid with 16 MB tiles that read the 4 GB work file about 20 times over.)
+# The power conservation check is accumulated band by band along the way.
+#
+# Usage:   def usource(xp,yp):                  # one band of rows of the field
+#              r2 = xp[None,:]**2+yp[:,None]**2
+#              u = E0*np.exp(-r2/w**2)*np.exp(1j*k*r2/2/roc)
+#              return u*triangle(a).inside(xp[None,:],yp[:,None])
+#          I,x,y,Pin,Pout = propagate_out_of_core(usource,32768,32768,dxp,dyp,
+#                                                 lam,M,'Ifield.npy')
+
+import os
+import mmap
+import numpy as np
+import fft_backend as fftb
+from propagator import chirp_factors,C,EPSILON0
+from instrument import stage                # optional timing of the passes
+
+TILE_BYTES = 256*2**20                  # bytes of field in memory at a time
+
+def propagate_out_of_core(usource,Nx,Ny,dxp,dyp,lam,abcd,outfile,workfile=None,
+                          intensity=True,dtype=np.complex128,tile_bytes=TILE_BYTES):
+    """Propagates the source field through the system abcd as in
+    fft_propagation.py, keeping the fields on disk.
+
+    SYNTAX: U,x,y,Pin,Pout = propagate_out_of_core(usource,Nx,Ny,dxp,dyp,lam,abcd,outfile
+                                                   <,workfile,intensity,dtype,tile_bytes>);
+            <...> indicates optional arguments
+
+    usource    = function usource(xp,yp) returning the source field at the
+                 points xp (vector, all Nx columns) and yp (vector, a band of
+                 rows), shape (len(yp),Nx); or an array or memmap of shape (Ny,Nx)
+    Nx, Ny     = number of pixels in the source plane grid
+    dxp, dyp   = interpixel distance in the source plane
+    lam        = wavelength
+    abcd       = ABCD matrix of the optical system
+    outfile    = .npy file the result is written to
+    workfile   = file for the intermediate (row transformed) field; the
+                 default is outfile+'.work'. Its transpose goes to
+                 workfile+'.T'. Both are deleted at the end; together they
+                 need twice the disk space of the complex field.
+    intensity  = if True (default) the intensity epsilon0*c/2*|u|^2 is
+                 written, otherwise the complex field
+    dtype      = np.complex128 (default) or np.complex64, which halves the
+                 size of the work file
+    tile_bytes = memory used for one band of rows or columns, or one block of
+                 the transpose (default 256 MB)
+
+    U          = the result, a read-only memmap of outfile, shape (Ny,Nx).
+                 It is stored in Fortran order (column by column), so reading
+                 it by columns or blocks is faster than by single rows.
+    x, y       = field plane coordinate vectors
+    Pin, Pout  = power in the source and field planes (trapezoidal rule)"""
+
+    dtype = np.dtype(dtype)
+    odtype = np.finfo(dtype).dtype if intensity else dtype
+    if workfile is None:
+        workfile = outfile+'.work'
+
+    sx,sy,fx,fy,dx,dy = chirp_factors(Nx,Ny,dxp,dyp,lam,abcd)
+    sx = sx.astype(dtype); sy = sy.astype(dtype)
+    fx = fx.astype(dtype); fy = fy.astype(dtype)
+    xp = (np.arange(0,Nx)-np.floor(Nx/2))*dxp
+    yp = (np.arange(0,Ny)-np.floor(Ny/2))*dyp
+    x = (np.arange(0,Nx)-np.floor(Nx/2))*dx
+    y = (np.arange(0,Ny)-np.floor(Ny/2))*dy
+    wx = _trapz_weights(Nx); wy = _trapz_weights(Ny)
+
+    # A band and its FFT are in memory together, hence the factor 2. The
+    # blocks of the transpose are a whole number of pages wide if they can be.
+    rows = int(max(1,min(Ny,tile_bytes//(2*Nx*dtype.itemsize))))
+    cols = int(max(1,min(Nx,tile_bytes//(2*Ny*dtype.itemsize))))
+    block = int(max(1,np.sqrt(tile_bytes/(2*dtype.itemsize))))
+    page = max(1,mmap.PAGESIZE//dtype.itemsize)
+    if block>=page:
+        block -= block%page
+
+    W = _work_array(workfile,dtype,(Ny,Nx))
+    WT = np.memmap(workfile+'.T',dtype=dtype,mode='w+',shape=(Nx,Ny))
+    try:
+        # Pass 1: source field and chirp, FFT along x, one band of rows at a time
+        Pin = 0.0
+        with stage('row fft'):
+            for r0 in range(0,Ny,rows):
+                r1 = min(r0+rows,Ny)
+                u = usource(xp,yp[r0:r1]) if callable(usource) else usource[r0:r1]
+                Pin += wy[r0:r1]@((EPSILON0*C/2*np.abs(u)**2)@wx)
+                t = np.multiply(u,sy[r0:r1,None],dtype=dtype)
+                t *= sx
+                W[r0:r1] = fftb.fft(t,axis=1)
+
+        # Pass 2: transpose, one square block at a time; each band of rows of
+        # WT is completed before the next is started
+        with stage('transpose'):
+            for c0 in range(0,Nx,block):
+                for r0 in range(0,Ny,block):
+                    WT[c0:c0+block,r0:r0+block] = W[r0:r0+block,c0:c0+block].T
+        W = None
+        os.remove(workfile)                     # frees its disk space for the output
+
+        # Pass 3: FFT along y (the rows of WT) and field chirp, one band at a
+        # time, written to the columns of the (Fortran ordered) output file
+        with stage('column fft'):
+            U = np.lib.format.open_memmap(outfile,mode='w+',dtype=odtype,shape=(Ny,Nx),
+                                          fortran_order=True)
+            Pout = 0.0
+            for c0 in range(0,Nx,cols):
+                c1 = min(c0+cols,Nx)
+                t = fftb.fft(WT[c0:c1],axis=1)
+                t *= fy
+                t *= fx[c0:c1,None]
+                I = EPSILON0*C/2*np.abs(t)**2
+                Pout += (wx[c0:c1]@I)@wy
+                U[:,c0:c1] = (I if intensity else t).T
+            U.flush()
+            del U
+    finally:
+        W = WT = None                           # unmapped before they are removed
+        for f in (workfile,workfile+'.T'):
+            if os.path.exists(f):
+                os.remove(f)
+
+    U = np.load(outfile,mmap_mode='r')
+    return U,x,y,Pin*dxp*dyp,Pout*dx*dy
+
+def _trapz_weights(N):
+    # Weights of the trapezoidal rule with unit spacing: 1, but 1/2 at the ends
+    w = np.ones(N)
+    w[0] = w[-1] = 0.5
+    return w
+
+def _work_array(filename,dtype,shape):
+    # A new file mapped as an array, without read-ahead: the transpose reads a
+    # block's width from each row, and read-ahead would also read (and once
+    # the file is larger than memory, read again) the rest of the row
+    dtype = np.dtype(dtype)
+    with open(filename,'w+b') as fid:
+        fid.truncate(int(np.prod(shape))*dtype.itemsize)
+        m = mmap.mmap(fid.fileno(),0)
+    if hasattr(mmap,'MADV_RANDOM'):                 # not on Windows
+        m.madvise(mmap.MADV_RANDOM)
+    return np.ndarray(shape,dtype,buffer=m)
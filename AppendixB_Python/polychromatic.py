@@ -0,0 +1,102 @@
+# polychromatic.py
+#
+# Broadband (incoherent) version of fft_propagation.py, e.g. for an LED or a
+# supercontinuum source. Each wavelength is propagated separately with its
+# own (cached) Propagator. Since the field plane pixel size is proportional
+# to the wavelength (dx = 1/dXp/Nx*h with h = sqrt(B*lam)), every result is
+# resampled onto one common output grid before the intensities are added
+# with their spectral weights. The wavelengths are shared out over a pool of
+# worker processes.
+
+import multiprocessing
+import numpy as np
+import fft_backend as fftb
+from propagator import get_propagator,C,EPSILON0
+
+def propagate_broadband(usource,dxp,dyp,lams,weights,abcd,x=None,y=None,
+                        dtype=np.complex128,processes=None):
+    """Returns the total intensity in the field plane of an incoherent sum of
+    wavelengths lams with spectral weights weights.
+
+    SYNTAX: I,x,y = propagate_broadband(usource,dxp,dyp,lams,weights,abcd <,x,y,
+                                        dtype,processes>);
+            <...> indicates optional arguments
+
+    usource   = source field, shape (Ny,Nx), the same for all wavelengths, or a
+                function usource(lam) that returns the field for wavelength
+                lam (for processes other than 1 it must be defined at the top
+                level of a module or script)
+    dxp, dyp  = interpixel distance in the source plane
+    lams      = wavelengths
+    weights   = relative power of each wavelength (e.g. the spectrum); the
+                intensities epsilon0*c/2*|u|^2 are multiplied by these
+    abcd      = ABCD matrix of the optical system
+    x, y      = field plane coordinate vectors of the common output grid.
+                The default is the field plane grid of the shortest
+                wavelength, the only one covered by every wavelength.
+    dtype     = np.complex128 (default) or np.complex64
+    processes = number of worker processes; None uses all cores, 1 runs serially
+
+    Outside the field plane grid of a wavelength its intensity is taken as 0."""
+
+    lams = np.atleast_1d(np.asarray(lams,dtype=float))
+    weights = np.broadcast_to(np.asarray(weights,dtype=float),np.shape(lams))
+    if callable(usource):
+        Ny,Nx = np.shape(usource(lams[0]))
+    else:
+        Ny,Nx = np.shape(usource)
+    if x is None or y is None:
+        P = get_propagator(Nx,Ny,dxp,dyp,np.min(lams),abcd,dtype)
+        x = P.x if x is None else x
+        y = P.y if y is None else y
+
+    jobs = [(lam,wt) for lam,wt in zip(lams,weights)]
+    setup = (usource,Nx,Ny,dxp,dyp,np.asarray(abcd,dtype=float),dtype,
+             np.asarray(x,dtype=float),np.asarray(y,dtype=float))
+    I = np.zeros((len(y),len(x)))
+    if processes==1:
+        _init_worker(setup,fftb.get_backend())
+        for Ik in map(_one_wavelength,jobs):
+            I += Ik
+    else:
+        # The source field and grids are sent to each worker once, not once
+        # per wavelength; results are added up as they arrive.
+        with multiprocessing.Pool(processes,initializer=_init_worker,
+                                  initargs=(setup,(fftb.get_backend()[0],1))) as pool:
+            for Ik in pool.imap_unordered(_one_wavelength,jobs):
+                I += Ik
+
+    return I,x,y
+
+def resample(I,x,y,xnew,ynew):
+    """Linearly interpolates the image I, sampled at the coordinate vectors x
+    (columns) and y (rows), onto the grid xnew, ynew. Points outside the
+    original grid are set to 0. The interpolation is done one axis at a
+    time, since both grids are rectangular.
+
+    SYNTAX: Inew = resample(I,x,y,xnew,ynew);"""
+
+    for axis,(old,new) in enumerate(((y,ynew),(x,xnew))):
+        s = (np.asarray(new)-old[0])/(old[1]-old[0])    # fractional index
+        inside = (s>=0) & (s<=len(old)-1)
+        i0 = np.clip(np.floor(s).astype(int),0,len(old)-2)
+        t = np.where(inside,s-i0,0)
+        I0 = np.take(I,i0,axis=axis); I1 = np.take(I,i0+1,axis=axis)
+        shape = [1,1]; shape[axis] = len(s)
+        t = np.reshape(t,shape); inside = np.reshape(inside,shape)
+        I = np.where(inside,I0*(1-t)+I1*t,0)
+    return I
+
+_worker = {}
+
+def _init_worker(setup,backend):
+    _worker['setup'] = setup
+    fftb.set_backend(*backend)
+
+def _one_wavelength(job):
+    lam,wt = job
+    usource,Nx,Ny,dxp,dyp,abcd,dtype,x,y = _worker['setup']
+    u = usource(lam) if callable(usource) else usource
+    P = get_propagator(Nx,Ny,dxp,dyp,lam,abcd,dtype) # chirps cached per wavelength
+    Ik = EPSILON0*C/2*np.abs(P(u))**2
+    return wt*resample(Ik,P.x,P.y,x,y)
@@ -0,0 +1,153 @@
+# profiles.py
+#
+# Intensity profiles ("cuts") along straight lines through beam images, a
+# generalization of image_cut.py. Any number of cuts, at any angle and
+# position, can be taken from an image or from a whole stack of images at
+# once: the sample points of all the cuts are interpolated in a single call
+# to scipy.ndimage.map_coordinates. The profiles are smoothed with a moving
+# mean computed from cumulative sums, so its cost doesn't depend on its width.
+#
+# Usage:   A = greyscale(plt.imread('myphoto.jpg'))
+#          P,s = line_profiles(A,[[640,512],[640,512]],[0,np.pi/2],length=800)
+#          P,s,axes = principal_cuts(stack,length=800,nsmooth=10)  # both beam axes
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+from beam_caustic import subtract_background
+
+def greyscale(A):
+    """Returns the mean of the R, G and B values of a colour image (or stack
+    of colour images, channels along the last axis), ignoring any alpha
+    channel. Greyscale images are returned unchanged."""
+
+    A = np.asarray(A)
+    if A.ndim>=3 and A.shape[-1] in (3,4):
+        return np.mean(A[...,0:3],-1)
+    return A
+
+def moving_mean(p,n,axis=-1):
+    """Moving mean of p over n samples along axis, as
+    np.convolve(p,np.ones(n),'valid')/n for every profile in p, but from a
+    cumulative sum, so the cost does not grow with n. The result is n-1
+    samples shorter than p. As with np.convolve, a mean is NaN only if its
+    window contains a NaN sample (e.g. from outside the image).
+
+    SYNTAX: ps = moving_mean(p,n <,axis>);
+            <...> indicates optional arguments"""
+
+    p = np.moveaxis(np.asarray(p,dtype=float),axis,-1)
+    missing = np.isnan(p)
+    c = np.zeros(p.shape[:-1]+(p.shape[-1]+1,))
+    k = np.zeros(c.shape,dtype=np.intp)
+    # NaNs would spread through a cumulative sum to every later mean, so they
+    # are summed as 0 and counted separately
+    np.cumsum(np.where(missing,0,p),axis=-1,out=c[...,1:])
+    np.cumsum(missing,axis=-1,out=k[...,1:])
+    ps = (c[...,n:]-c[...,:-n])/n
+    ps[k[...,n:]>k[...,:-n]] = np.nan
+    return np.moveaxis(ps,-1,axis)
+
+def line_profiles(A,centers,angles,length,npts=None,nsmooth=1,order=1,per_image=False):
+    """Returns the profiles of the image (or stack of images) A along
+    straight cuts of a given length, centered on centers at angles angles.
+
+    SYNTAX: P,s = line_profiles(A,centers,angles,length <,npts,nsmooth,order,per_image>);
+            <...> indicates optional arguments
+
+    A       = greyscale image (rows,cols) or stack of images (nimages,rows,cols)
+    centers = (x,y) center of each cut in pixels, x along the columns and y
+              along the rows; shape (...,2)
+    angles  = direction of each cut in radians, from the x axis (along a row)
+              towards the y axis; np.pi/2 is a vertical cut along a column
+    length  = length of the cuts in pixels
+    npts    = number of samples per cut (default: one per pixel, length+1)
+    nsmooth = width (in samples) of the moving mean applied to the
+              profiles, as in image_cut.py; default 1 (no smoothing)
+    order   = order of the spline interpolation, 1 (default, linear) to 5
+    per_image = (stacks only) if False (default) the same cuts are taken
+              from every image; if True the first axis of centers[...,0]
+              and angles is the image axis, so each image has its own cuts
+              (e.g. through its centroid)
+
+    For a single image the cuts have the broadcast shape of centers[...,0]
+    and angles, and P has that shape plus one axis along the cuts. For a
+    stack P has a leading axis for the images: shared cuts of any shape S
+    give P the shape (nimages,)+S+(npts,); with per_image=True cuts of shape
+    (nimages,)+S give the same.
+
+    s is the position along the cuts (pixels from their centers) of the
+    samples of P. Samples that fall outside the image are NaN."""
+
+    A = np.asarray(A)
+    stack = A.ndim==3
+    centers = np.asarray(centers,dtype=float)
+    cx,cy,th = np.broadcast_arrays(centers[...,0],centers[...,1],np.asarray(angles,dtype=float))
+    if stack:
+        nimg = A.shape[0]
+        shape = (nimg,)+(np.shape(cx)[1:] if per_image else np.shape(cx))
+        cx,cy,th = [np.broadcast_to(v,shape) for v in (cx,cy,th)]
+
+    npts = int(np.floor(length))+1 if npts is None else int(npts)
+    s = np.linspace(-length/2,length/2,npts)
+    cols = cx[...,None]+s*np.cos(th)[...,None]
+    rows = cy[...,None]+s*np.sin(th)[...,None]
+    if stack:
+        k = np.broadcast_to(np.arange(nimg).reshape((nimg,)+(1,)*(rows.ndim-1)),rows.shape)
+        coords = np.stack([k,rows,cols])
+    else:
+        coords = np.stack([rows,cols])
+
+    # A linear interpolation needs no spline prefilter; higher orders filter
+    # the image once. Along the image axis of a stack the samples are at whole
+    # numbers, so the images are not mixed.
+    P = map_coordinates(A,coords,output=float,order=order,mode='constant',cval=np.nan,
+                        prefilter=order>1)
+    if nsmooth>1:
+        P = moving_mean(P,nsmooth)
+        s = moving_mean(s,nsmooth)
+    return P,s
+
+def principal_axes(A,background='border'):
+    """Returns the centroid and the principal axes of the beam in the image
+    (or stack of images) A, from its second moments.
+
+    SYNTAX: cx,cy,theta,wmaj,wmin = principal_axes(A <,background>);
+            <...> indicates optional arguments
+
+    cx, cy     = centroid (column, row) in pixels
+    theta      = angle of the major axis from the x axis (as in line_profiles)
+    wmaj, wmin = D4sigma beam radii (2 sigma) along the major and minor axes
+    background = as in beam_moments"""
+
+    A = subtract_background(A,background)
+    x = np.arange(A.shape[-1]); y = np.arange(A.shape[-2])
+    Px = np.sum(A,axis=-2); Py = np.sum(A,axis=-1)
+    P = np.sum(Px,axis=-1)
+    cx = (Px@x)/P; cy = (Py@y)/P
+    sxx = (Px@x**2)/P-cx**2
+    syy = (Py@y**2)/P-cy**2
+    sxy = np.einsum('...rc,r,c->...',A,y,x)/P-cx*cy
+    theta = 0.5*np.arctan2(2*sxy,sxx-syy)
+    d = np.sqrt(((sxx-syy)/2)**2+sxy**2)
+    wmaj = 2*np.sqrt((sxx+syy)/2+d)
+    wmin = 2*np.sqrt(np.maximum((sxx+syy)/2-d,0))
+    return cx,cy,theta,wmaj,wmin
+
+def principal_cuts(A,length,npts=None,nsmooth=1,order=1,background='border'):
+    """Takes two cuts through the centroid of each image, along its major
+    and minor axes (see principal_axes).
+
+    SYNTAX: P,s,axes = principal_cuts(A,length <,npts,nsmooth,order,background>);
+            <...> indicates optional arguments
+
+    P    = profiles, shape (2,npts) for one image or (nimages,2,npts) for a
+           stack; P[...,0,:] is along the major axis, P[...,1,:] the minor
+    s    = positions along the cuts (see line_profiles)
+    axes = (cx,cy,theta,wmaj,wmin) from principal_axes"""
+
+    axes = principal_axes(A,background)
+    cx,cy,theta = axes[:3]
+    centers = np.stack([cx,cy],-1)[...,None,:]          # the same center for both cuts
+    angles = np.stack([theta,theta+np.pi/2],-1)
+    P,s = line_profiles(A,centers,angles,length,npts,nsmooth,order,per_image=True)
+    return P,s,axes
@@ -0,0 +1,178 @@
+# propagator.py
+#
+# A reusable version of the Fresnel (ABCD) propagation carried out in
+# fft_propagation.py. Everything that depends only on the sampling grid,
+# the wavelength and the ABCD matrix (the coordinate vectors and both
+# quadratic phase "chirps") is computed once when a Propagator is made.
+# Pushing a source field through the system then costs one multiply,
+# one FFT and one multiply. The FFT library is chosen in fft_backend.py.
+
+import functools
+import numpy as np
+import fft_backend as fftb
+
+PROPAGATOR_CACHE_SIZE = 8               # number of Propagators kept by get_propagator
+C = 3e8                                 # speed of light in m/s
+EPSILON0 = 8.854e-12                    # vacuum permittivity in F/m
+
+class Propagator:
+    """Fresnel propagator for a fixed sampling grid, wavelength and ABCD
+    matrix. Calling the object on a source field returns the field in
+    the field plane, exactly as computed in fft_propagation.py.
+
+    SYNTAX: P = Propagator(Nx,Ny,dxp,dyp,lam,abcd <,dtype>);
+            ufield = P(usource);
+            <...> indicates optional arguments
+
+    Nx, Ny   = number of pixels in the source plane grid
+    dxp, dyp = interpixel distance in the source plane
+    lam      = wavelength
+    abcd     = ABCD matrix of the optical system (B must be > 0)
+    dtype    = np.complex128 (default) or np.complex64. In single 
+               precision the chirps, the FFT and the returned field are
+               complex64 and the coordinates float32, halving the memory.
+
+    usource may also be a stack of fields with shape (...,Ny,Nx); every
+    field in the stack is propagated. The source plane coordinates are
+    P.xp, P.yp and the field plane coordinates are P.x, P.y (vectors;
+    use np.meshgrid for 2D grids). All lengths in the same units."""
+
+    def __init__(self,Nx,Ny,dxp,dyp,lam,abcd,dtype=np.complex128):
+        AA,BB,CC,DD = np.ravel(np.asarray(abcd,dtype=float))
+        self.dtype = np.dtype(dtype)
+        rdtype = np.finfo(self.dtype).dtype     # matching real type
+        self.Nx = Nx; self.Ny = Ny
+        self.dxp = dxp; self.dyp = dyp
+        self.lam = lam
+        self.abcd = np.array([[AA,BB],[CC,DD]])
+
+        nx = np.arange(0,Nx); ny = np.arange(0,Ny)
+        self.xp = (nx-np.floor(Nx/2))*dxp           # src plane x-coords
+        self.yp = (ny-np.floor(Ny/2))*dyp           # src plane y-coords
+        sx,sy,fx,fy,self.dx,self.dy = chirp_factors(Nx,Ny,dxp,dyp,lam,self.abcd)
+        self.x = (nx-np.floor(Nx/2))*self.dx        # field plane x-coords
+        self.y = (ny-np.floor(Ny/2))*self.dy        # field plane y-coords
+
+        # The phases are always evaluated in double precision; the 1D factors
+        # are rounded to the working precision before the 2D outer product.
+        sx = sx.astype(self.dtype); sy = sy.astype(self.dtype)
+        fx = fx.astype(self.dtype); fy = fy.astype(self.dtype)
+        self.src_chirp = np.outer(sy,sx)            # exp(1j*pi*A*(Xp^2+Yp^2)) x shift
+        self.field_chirp = np.outer(fy,fx)          # -1j*exp(1j*pi*D/B/lam*(x^2+y^2))*dXp*dYp
+        for v in ('xp','yp','x','y'):
+            setattr(self,v,getattr(self,v).astype(rdtype))
+
+    def __call__(self,usource):
+        u = np.multiply(self.src_chirp,usource,dtype=self.dtype)
+        return self.field_chirp*fftb.fft2(u)
+
+    def power(self,u,plane='field'):
+        """Returns the power carried by the field u, i.e. the trapezoidal
+        integral of the intensity epsilon0*c/2*|u|^2 over the source 
+        (plane='source') or field (plane='field', default) plane grid,
+        as done in the energy conservation check of fft_propagation.py.
+        The sum is accumulated in double precision for any dtype of u."""
+
+        if plane=='source':
+            dA = self.dxp*self.dyp
+        else:
+            dA = self.dx*self.dy
+        return trapz2(EPSILON0*C/2*np.abs(u)**2)*dA
+
+def chirp_factors(Nx,Ny,dxp,dyp,lam,abcd,shift=True):
+    """Returns the 1D factors of the source and field plane chirps of the
+    Fresnel propagation in fft_propagation.py, and the field plane sampling
+    intervals. The 2D chirps are the outer products np.outer(sy,sx) and
+    np.outer(fy,fx); fx includes the constant factor -1j*dXp*dYp.
+
+    SYNTAX: sx,sy,fx,fy,dx,dy = chirp_factors(Nx,Ny,dxp,dyp,lam,abcd <,shift>);
+            <...> indicates optional arguments
+
+    Only 1D exponentials are evaluated, since both chirps are separable in x
+    and y. With shift=True (default) the fftshift of the result is folded
+    into sx and sy as the linear phase exp(2j*pi*n*(N//2)/N) (see
+    shift_phase), which moves the zero frequency to the center without an
+    extra pass over the data."""
+
+    AA,BB,CC,DD = np.ravel(np.asarray(abcd,dtype=float))
+    h = np.sqrt(BB*lam)                         # scaling factor (see fft_propagation.py)
+    dXp = dxp/h; dYp = dyp/h                    # src interpixel dist in the new units
+    dx = 1/dXp/Nx*h; dy = 1/dYp/Ny*h            # field plane sampling interval
+    xp = (np.arange(0,Nx)-np.floor(Nx/2))*dxp   # src plane x-coords
+    yp = (np.arange(0,Ny)-np.floor(Ny/2))*dyp   # src plane y-coords
+    x = (np.arange(0,Nx)-np.floor(Nx/2))*dx     # field plane x-coords
+    y = (np.arange(0,Ny)-np.floor(Ny/2))*dy     # field plane y-coords
+
+    sx = np.exp(1j*np.pi*AA*(xp/h)**2)
+    sy = np.exp(1j*np.pi*AA*(yp/h)**2)
+    if shift:
+        sx = sx*shift_phase(Nx)
+        sy = sy*shift_phase(Ny)
+    fx = -1j*dXp*dYp*np.exp(1j*np.pi*DD/BB/lam*x**2)
+    fy = np.exp(1j*np.pi*DD/BB/lam*y**2)
+    return sx,sy,fx,fy,dx,dy
+
+def shift_phase(N):
+    """Returns exp(2j*pi*n*(N//2)/N), n = 0 ... N-1. Multiplying the input of
+    an FFT by this is the same as applying fftshift to its output."""
+
+    n = np.arange(0,N)
+    return np.exp(2j*np.pi*((n*(N//2))%N)/N)
+
+def get_propagator(Nx,Ny,dxp,dyp,lam,abcd,dtype=np.complex128):
+    """Returns a Propagator for the given grid, wavelength and ABCD
+    matrix, reusing a previously made one if the same arguments were
+    seen recently. The last PROPAGATOR_CACHE_SIZE propagators are kept;
+    the least recently used one is discarded first.
+
+    SYNTAX: P = get_propagator(Nx,Ny,dxp,dyp,lam,abcd <,dtype>);
+            <...> indicates optional arguments"""
+
+    abcd = tuple(np.ravel(np.asarray(abcd,dtype=float)).tolist()) # hashable key
+    return _cached_propagator(int(Nx),int(Ny),float(dxp),float(dyp),float(lam),abcd,
+                              np.dtype(dtype))
+
+@functools.lru_cache(maxsize=PROPAGATOR_CACHE_SIZE)
+def _cached_propagator(Nx,Ny,dxp,dyp,lam,abcd,dtype):
+    return Propagator(Nx,Ny,dxp,dyp,lam,np.reshape(abcd,(2,2)),dtype)
+
+def trapz2(I):
+    """2D trapezoidal sum of I over its last two axes with unit spacing
+    (the same as np.trapz(np.trapz(I)) in fft_propagation.py). The sum is
+    accumulated in double precision without making a float64 copy of I.
+
+    SYNTAX: S = trapz2(I);"""
+
+    S = np.sum(I,axis=(-2,-1),dtype=np.float64)
+    S = S - 0.5*(np.sum(I[...,0,:],axis=-1,dtype=np.float64) + np.sum(I[...,-1,:],axis=-1,dtype=np.float64)
+                 + np.sum(I[...,:,0],axis=-1,dtype=np.float64) + np.sum(I[...,:,-1],axis=-1,dtype=np.float64))
+    S = S + 0.25*(I[...,0,0] + I[...,0,-1] + I[...,-1,0] + I[...,-1,-1]).astype(np.float64)
+    return S
+
+def precision_report(Nx,Ny,dxp,dyp,lam,abcd,usource):
+    """Propagates usource in double (complex128) and single (complex64)
+    precision and reports how well each conserves power, and how far
+    the single precision result is from the double precision one.
+
+    SYNTAX: rep = precision_report(Nx,Ny,dxp,dyp,lam,abcd,usource);
+
+    rep is a dictionary with entries
+    Pin          = power in the source plane
+    Pout_double  = power in the field plane, double precision
+    Pout_single  = power in the field plane, single precision
+    err_double   = |Pout_double-Pin|/Pin
+    err_single   = |Pout_single-Pin|/Pin
+    err_vs_double= |Pout_single-Pout_double|/Pout_double
+    field_err    = max|u_single-u_double| / max|u_double|"""
+
+    P64 = get_propagator(Nx,Ny,dxp,dyp,lam,abcd,np.complex128)
+    P32 = get_propagator(Nx,Ny,dxp,dyp,lam,abcd,np.complex64)
+    u64 = P64(usource)
+    u32 = P32(usource)
+    Pin = P64.power(usource,'source')
+    P64out = P64.power(u64)
+    P32out = P32.power(u32)
+    return {'Pin': Pin, 'Pout_double': P64out, 'Pout_single': P32out,
+            'err_double': abs(P64out-Pin)/Pin, 'err_single': abs(P32out-Pin)/Pin,
+            'err_vs_double': abs(P32out-P64out)/P64out,
+            'field_err': np.max(np.abs(u32-u64))/np.max(np.abs(u64))}
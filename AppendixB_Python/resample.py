@@ -0,0 +1,96 @@
+# resample.py
+#
+# Estimates the uncertainties of fitted parameters by refitting many
+# resampled versions of the data, as a check on (or replacement for) the
+# uncertainties from the covariance matrix returned by curve_fit. This
+# matters for nonlinear models, where the covariance matrix can be a poor
+# description of the real parameter uncertainties. The refits are shared
+# out over a pool of worker processes and each one starts from the
+# nominal best fit.
+#
+# Usage (see make_and_fit_data.py for fitfunc, x, y, yerr and a):
+#          res = resample_fit(fitfunc,x,y,yerr,a,'montecarlo',nsamples=5000)
+#          print(res['std'], res['ci'])
+
+import multiprocessing
+import numpy as np
+from scipy.optimize import curve_fit
+
+SAMPLES_PER_JOB = 50                    # refits handed to a worker at a time
+
+def resample_fit(fitfunc,x,y,yerr,a,method='bootstrap',nsamples=1000,
+                 processes=None,seed=None,cl=0.6827):
+    """Refits nsamples resampled data sets and returns the distribution of
+    the fitted parameters.
+
+    SYNTAX: res = resample_fit(fitfunc,x,y,yerr,a <,method,nsamples,processes,seed,cl>);
+            <...> indicates optional arguments
+
+    fitfunc   = model, fitfunc(x,a1,a2,...), as used with curve_fit. For
+                processes other than 1 it must be defined at the top level
+                of a module or script so the workers can find it.
+    x,y,yerr  = the data and the uncertainties of y
+    a         = nominal best fit parameters; every refit starts from these
+    method    = 'bootstrap' (default): data points are drawn with replacement
+                'montecarlo': synthetic data fitfunc(x,*a) + yerr*N(0,1)
+    nsamples  = number of refits (default 1000)
+    processes = number of worker processes; None uses all cores, 1 runs serially
+    seed      = seed for the random numbers, for reproducible results
+    cl        = confidence level of the intervals (default 0.6827, i.e. 1 sigma)
+
+    res is a dictionary with entries
+    samples = (nsamples, npar) array of refitted parameters (NaN where a
+              refit failed to converge)
+    mean, std = mean and standard deviation of each parameter
+    ci      = (npar, 2) array, the central confidence interval of each parameter
+    corr    = (npar, npar) correlation matrix of the parameters
+    nfailed = number of refits that failed"""
+
+    if method not in ('bootstrap','montecarlo'):
+        raise ValueError("Unknown resampling method '"+str(method)+"'")
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    yerr = np.asarray(yerr,dtype=float)*np.ones(np.shape(y))
+    a = np.asarray(a,dtype=float)
+
+    # Independent random streams for every job, so the result for a given
+    # seed doesn't depend on the number of processes.
+    sizes = [SAMPLES_PER_JOB]*(nsamples//SAMPLES_PER_JOB)
+    if nsamples%SAMPLES_PER_JOB:
+        sizes.append(nsamples%SAMPLES_PER_JOB)
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(fitfunc,x,y,yerr,a,method,n,ss) for n,ss in zip(sizes,streams)]
+
+    if processes==1:
+        results = list(map(_refit,jobs))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_refit,jobs)
+    samples = np.concatenate(results)
+
+    ok = np.all(np.isfinite(samples),axis=1)
+    good = samples[ok]
+    tail = 50*(1-cl)
+    return {'samples': samples,
+            'mean': np.mean(good,axis=0),
+            'std': np.std(good,axis=0,ddof=1),
+            'ci': np.transpose(np.percentile(good,[tail,100-tail],axis=0)),
+            'corr': np.corrcoef(good,rowvar=False),
+            'nfailed': int(np.sum(~ok))}
+
+def _refit(job):
+    fitfunc,x,y,yerr,a,method,n,seedseq = job
+    rng = np.random.default_rng(seedseq)
+    out = np.full((n,len(a)),np.nan)
+    ymodel = fitfunc(x,*a)
+    for s in range(n):
+        if method=='bootstrap':
+            i = rng.integers(0,len(x),len(x))   # draw points with replacement
+            xs,ys,es = x[i],y[i],yerr[i]
+        else:
+            xs,ys,es = x,ymodel+yerr*rng.standard_normal(len(x)),yerr
+        try:
+            out[s],_ = curve_fit(fitfunc,xs,ys,p0=a,sigma=es,absolute_sigma=True)
+        except (RuntimeError,ValueError):        # no convergence / degenerate sample
+            pass
+    return out
@@ -0,0 +1,81 @@
+# resonator.py
+#
+# Finds the self-consistent Gaussian beam (eigenmode) of an optical cavity
+# from its round-trip ABCD matrix, instead of iterating prop() by hand.
+# Everything is done element by element, so whole grids of cavity lengths
+# and mirror radii (10^6 cavities or more) are analysed in one call, e.g.
+#
+#   L  = np.linspace(0.01,0.5,1000)[:,None]
+#   R2 = np.linspace(0.05,1.0,1000)[None,:]
+#   res = eigenmode(two_mirror_roundtrip(L,np.inf,R2),lam=633e-9)
+#   plt.pcolormesh(res['stable'])              # stability diagram
+
+import numpy as np
+from AppendixB_functions import prop,R_,abcd_free,abcd_mirror,abcd_chain
+
+C = 3e8                                 # speed of light in m/s
+
+def two_mirror_roundtrip(L,R1,R2):
+    """Returns the round-trip ABCD matrix of a two-mirror cavity of length
+    L with mirror radii of curvature R1 and R2 (R>0 concave, np.inf flat).
+    The reference plane is at mirror 1. L, R1 and R2 may be broadcastable
+    arrays; the result then has shape (...,2,2).
+
+    SYNTAX: M = two_mirror_roundtrip(L,R1,R2);"""
+
+    return abcd_chain([abcd_free(L),abcd_mirror(R2),abcd_free(L),abcd_mirror(R1)])
+
+def eigenmode(M,mode=[0,0],lam=None,Lrt=None):
+    """Returns the eigenmode and related properties of a cavity with the
+    round-trip ABCD matrix M (e.g. from abcd_chain or two_mirror_roundtrip).
+
+    SYNTAX: res = eigenmode(M <,[n,m],lam,Lrt>);
+            <...> indicates optional arguments
+
+    M   = round-trip matrix, 2x2 or a stack of shape (...,2,2)
+    n,m = mode designators of the higher order mode of interest
+    lam = wavelength; if given, the beam radius and phasefront curvature
+          of the eigenmode at the reference plane are returned too
+    Lrt = round-trip optical path length; if given, the free spectral
+          range and the mode spacing in Hz are returned too
+
+    res is a dictionary of arrays with the shape of the stack:
+    stability  = (A+D)/2; the cavity is stable for |stability| < 1. For a
+                 two-mirror cavity, g1*g2 = (stability+1)/2
+    stable     = True where the cavity is stable
+    q          = eigenmode q at the reference plane (NaN where unstable)
+    gouy       = round-trip Gouy phase of the TEM_00 mode, in radians
+                 between 0 and 2*pi
+    spacing    = frequency offset of TEM_nm from TEM_00 in units of the
+                 free spectral range, (n+m)*gouy/(2*pi) modulo 1
+    R, w       = (if lam given) eigenmode curvature and radius
+    fsr, spacing_hz = (if Lrt given) c/Lrt and spacing*fsr in Hz"""
+
+    M = np.asarray(M,dtype=float)
+    A = M[...,0,0]; B = M[...,0,1]; D = M[...,1,1]
+    stability = (A+D)/2
+    stable = np.abs(stability)<1
+
+    # Self-consistency q = (A*q+B)/(C*q+D) gives, for a stable cavity,
+    # 1/q = (D-A)/(2B) - 1j*sqrt(1-((A+D)/2)^2)/|B|  (Im(q) > 0).
+    # (np.divide, so that B = 0 in a single 2x2 matrix gives NaN like in a
+    # stack, instead of Python's ZeroDivisionError for complex scalars)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        qinv = np.divide(D-A,2*B) - 1j*np.divide(np.sqrt(1-stability**2),np.abs(B))
+        q = np.where(stable,np.divide(1,qinv),np.nan)[()]
+
+        # The round-trip phase of TEM_00 from prop(), as p = exp(1j*gouy),
+        # taken in [0,2*pi) (np.angle alone would wrap phases above pi)
+        _,p = prop(q,M)
+        gouy = np.mod(np.angle(p),2*np.pi)
+    spacing = np.mod((mode[0]+mode[1])*gouy/(2*np.pi),1)
+
+    res = {'stability': stability, 'stable': stable, 'q': q, 'gouy': gouy,
+           'spacing': spacing}
+    if lam is not None:
+        with np.errstate(invalid='ignore'):
+            res['R'],res['w'] = R_(q,lam)
+    if Lrt is not None:
+        res['fsr'] = C/np.asarray(Lrt)
+        res['spacing_hz'] = spacing*res['fsr']
+    return res
@@ -0,0 +1,171 @@
+# sweep.py
+#
+# Runs a diffraction simulation like fft_propagation.py for every point of a
+# grid of parameter values (L1, L2, f, the aperture size a, roc, ...) on a
+# pool of worker processes. Large arrays that all runs need, such as the
+# source plane coordinate grids and the incident beam profile, are put in
+# shared memory once instead of being copied to every worker. The results
+# are collected in arrays labelled by the parameter values, together with
+# the power conservation check of each run.
+#
+# Usage:   def peak(I,x,y):
+#              return np.max(I)
+#          res = fresnel_sweep({'L2': np.linspace(0.02,0.1,40),
+#                               'a': np.linspace(1e-3,3e-3,25)},metric=peak)
+#          res['result'][i,j]   # peak irradiance for L2[i], a[j]
+
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import fft_backend as fftb
+from propagator import get_propagator,C,EPSILON0
+from apertures import triangle
+
+# Parameters of fft_propagation.py, used for anything not being swept
+DEFAULTS = {'L1': 0.035, 'L2': 0.05, 'f': -0.03, 'a': 3000e-6, 'roc': 0.5, 'lam': 633e-9}
+
+def sweep(func,grid,shared=None,processes=None):
+    """Calls func(shared,**params) for every combination of the parameter
+    values in grid, in parallel, and collects the results.
+
+    SYNTAX: res = sweep(func,grid <,shared,processes>);
+            <...> indicates optional arguments
+
+    func      = function returning (result, diagnostics) for one set of
+                parameters; result is a number or an array (the same shape
+                for every run), diagnostics a dictionary of numbers. It must
+                be defined at the top level of a module or script.
+    grid      = dictionary {name: vector of values}; all combinations are run
+    shared    = dictionary {name: array} of read-only inputs for every run.
+                They are placed in shared memory, and func receives them as
+                a dictionary of arrays backed by it.
+    processes = number of worker processes; None uses all cores, 1 runs serially
+
+    res is a dictionary with
+    axes   = the grid, {name: values}, in the order of the result axes
+    result = array of shape (len(values1),len(values2),...)+result.shape
+    and one array of shape (len(values1),len(values2),...) per diagnostic."""
+
+    names = list(grid)
+    axes = {name: np.atleast_1d(grid[name]) for name in names}
+    shape = tuple(len(v) for v in axes.values())
+    jobs = [(k,dict(zip(names,vals)))
+            for k,vals in enumerate(itertools.product(*axes.values()))]
+    shared = shared or {}
+
+    results = {}
+    def collect(k,result,diagnostics):
+        if not results:                         # allocate when the first result is in
+            results['result'] = np.empty((len(jobs),)+np.shape(result),np.result_type(result))
+            for d,v in diagnostics.items():
+                results[d] = np.empty(len(jobs),np.result_type(v))
+        results['result'][k] = result
+        for d,v in diagnostics.items():
+            results[d][k] = v
+
+    if processes==1:
+        for k,params in jobs:
+            collect(k,*func(shared,**params))
+    else:
+        blocks = {}
+        try:
+            specs = {}
+            for name,arr in shared.items():
+                arr = np.ascontiguousarray(arr)
+                shm = shared_memory.SharedMemory(create=True,size=max(arr.nbytes,1))
+                np.ndarray(arr.shape,arr.dtype,buffer=shm.buf)[...] = arr
+                blocks[name] = shm
+                specs[name] = (shm.name,arr.shape,arr.dtype.str)
+            with multiprocessing.Pool(processes,initializer=_init_worker,
+                                      initargs=(func,specs,(fftb.get_backend()[0],1))) as pool:
+                for k,out in pool.imap_unordered(_run,jobs):
+                    collect(k,*out)
+        finally:
+            for shm in blocks.values():
+                shm.close()
+                shm.unlink()
+
+    res = {'axes': axes}
+    for key,val in results.items():
+        res[key] = np.reshape(val,shape+np.shape(val)[1:])
+    return res
+
+_worker = {}
+
+def _init_worker(func,specs,backend):
+    _worker['func'] = func
+    _worker['blocks'] = {}                      # keeps the shared memory attached
+    _worker['shared'] = {}
+    for name,(shmname,shape,dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shmname)
+        arr = np.ndarray(shape,np.dtype(dtype),buffer=shm.buf)
+        arr.setflags(write=False)
+        _worker['blocks'][name] = shm
+        _worker['shared'][name] = arr
+    fftb.set_backend(*backend)
+
+def _run(job):
+    k,params = job
+    return k,_worker['func'](_worker['shared'],**params)
+
+def fresnel_sweep(grid,Nx=512,Ny=512,xmax=0.002,ymax=0.002,w=750e-6,I0=7617.5,
+                  metric=None,dtype=np.complex128,processes=None):
+    """Runs the simulation of fft_propagation.py (Gaussian beam with curved
+    phasefront through an equilateral triangular aperture, then the system
+    [FREE SPACE L1 : LENS f : FREE SPACE L2]) for every combination of the
+    values in grid, using sweep().
+
+    SYNTAX: res = fresnel_sweep(grid <,Nx,Ny,xmax,ymax,w,I0,metric,dtype,processes>);
+            <...> indicates optional arguments
+
+    grid   = {name: values} for any of 'L1', 'L2', 'f', 'a', 'roc', 'lam'. The
+             others take the values of fft_propagation.py (see DEFAULTS).
+    metric = function metric(Ifield,x,y) that reduces the field plane
+             irradiance to what is to be kept (x, y are the field plane
+             coordinate vectors). It must be defined at the top level of a
+             module or script for processes other than 1. The default
+             keeps the whole irradiance array.
+
+    res is as returned by sweep(), with the diagnostics 'Pin' and 'Pout'
+    (source and field plane power) and 'err' = |Pout-Pin|/Pin."""
+
+    unknown = set(grid)-set(DEFAULTS)
+    if unknown:
+        raise ValueError('Cannot sweep '+', '.join(sorted(unknown)))
+    E0 = np.sqrt(2*I0/C/EPSILON0)                       # max field ampl. in src plane
+    dxp = 2*xmax/(Nx-1); dyp = 2*ymax/(Ny-1)            # interpixel dist. in the src plane
+    xp = (np.arange(0,Nx)-np.floor(Nx/2))*dxp
+    yp = (np.arange(0,Ny)-np.floor(Ny/2))*dyp
+    r2 = xp[None,:]**2+yp[:,None]**2
+    shared = {'xp': xp, 'yp': yp, 'r2': r2, 'envelope': E0*np.exp(-r2/w**2)}
+
+    fixed = {name: val for name,val in DEFAULTS.items() if name not in grid}
+    return sweep(_FresnelRun(fixed,dxp,dyp,metric,dtype),grid,shared,processes)
+
+class _FresnelRun:
+    # A picklable function object: one run of fft_propagation.py
+    def __init__(self,fixed,dxp,dyp,metric,dtype):
+        self.fixed = fixed; self.dxp = dxp; self.dyp = dyp
+        self.metric = metric; self.dtype = dtype
+
+    def __call__(self,shared,**params):
+        p = dict(self.fixed,**params)
+        xp,yp = shared['xp'],shared['yp']
+        aperture = triangle(p['a']).mask(xp,yp)         # equil. triangular aperture
+        k = 2*np.pi/p['lam']
+        usource = shared['envelope']*np.exp(1j*k*shared['r2']/2/p['roc'])
+        usource[np.logical_not(aperture)] = 0
+
+        M = np.array([[1,p['L2']],[0,1]]) \
+            @ np.array([[1,0],[-1/p['f'],1]]) \
+            @ np.array([[1,p['L1']],[0,1]])
+        Ny,Nx = len(yp),len(xp)
+        P = get_propagator(Nx,Ny,self.dxp,self.dyp,p['lam'],M,self.dtype)
+        ufield = P(usource)
+        Ifield = EPSILON0*C/2*np.abs(ufield)**2
+
+        Pin = P.power(usource,'source')
+        Pout = P.power(ufield)
+        result = Ifield if self.metric is None else self.metric(Ifield,P.x,P.y)
+        return result,{'Pin': Pin, 'Pout': Pout, 'err': abs(Pout-Pin)/Pin}
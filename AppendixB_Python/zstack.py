@@ -0,0 +1,86 @@
+# zstack.py
+#
+# Computes the field (or intensity) of fft_propagation.py at many output
+# planes in one call, e.g. to follow a beam through a focus. Each plane has
+# its own ABCD matrix, usually the system before the last free space
+# followed by free space of a different length:
+#
+#   M = abcd_chain([abcd_free(L1),abcd_lens(f),abcd_free(L2)])  # L2 a vector
+#   I,dx,dy = propagate_zstack(usource,dxp,dyp,lam,M)
+#
+# The planes are done in chunks as one batched FFT per chunk, with the chunk
+# size set by a memory budget. The result can be streamed to a .npy file on
+# disk plane by plane instead of being kept in memory.
+
+import numpy as np
+import fft_backend as fftb
+from propagator import chirp_factors,shift_phase,C,EPSILON0
+
+MEM_BUDGET = 1024*2**20                 # bytes used for the planes being computed
+
+def propagate_zstack(usource,dxp,dyp,lam,abcd,intensity=True,dtype=np.complex128,
+                     mem_budget=MEM_BUDGET,out=None):
+    """Propagates usource through each of the ABCD matrices in abcd and
+    returns the result at all the output planes.
+
+    SYNTAX: U,dx,dy = propagate_zstack(usource,dxp,dyp,lam,abcd <,intensity,dtype,
+                                       mem_budget,out>);
+            <...> indicates optional arguments
+
+    usource    = source field, shape (Ny,Nx), as in fft_propagation.py
+    dxp, dyp   = interpixel distance in the source plane
+    lam        = wavelength
+    abcd       = stack of ABCD matrices, shape (nplanes,2,2), one per plane
+    intensity  = if True (default) the intensity epsilon0*c/2*|u|^2 is returned,
+                 otherwise the complex field
+    dtype      = np.complex128 (default) or np.complex64
+    mem_budget = bytes used for the planes in progress (default 1 GB)
+    out        = None (default): the result is returned as an array
+                 a filename: the result is written, one chunk of planes at a
+                 time, to that .npy file, which is returned as a memmap
+                 an array of shape (nplanes,Ny,Nx): the result is written into it
+
+    U          = field or intensity at each plane, shape (nplanes,Ny,Nx)
+    dx, dy     = field plane sampling interval of each plane (vectors); the
+                 coordinates of plane k are (arange(N)-floor(N/2))*dx[k]"""
+
+    dtype = np.dtype(dtype)
+    abcd = np.reshape(np.asarray(abcd,dtype=float),(-1,2,2))
+    nplanes = len(abcd)
+    Ny,Nx = np.shape(usource)
+    odtype = np.finfo(dtype).dtype if intensity else dtype
+
+    if out is None:
+        out = np.empty((nplanes,Ny,Nx),dtype=odtype)
+    elif isinstance(out,str):
+        out = np.lib.format.open_memmap(out,mode='w+',dtype=odtype,shape=(nplanes,Ny,Nx))
+
+    # The part of the source field product that is the same for all planes:
+    # the field itself with the fftshift phase folded in.
+    u0 = np.multiply(usource,np.outer(shift_phase(Ny),shift_phase(Nx)),dtype=dtype)
+
+    dx = np.empty(nplanes); dy = np.empty(nplanes)
+    chunk = max(1,int(mem_budget//(2*Ny*Nx*dtype.itemsize))) # planes + their FFTs
+    for k0 in range(0,nplanes,chunk):
+        k1 = min(k0+chunk,nplanes)
+        factors = [chirp_factors(Nx,Ny,dxp,dyp,lam,M,shift=False) for M in abcd[k0:k1]]
+        sx = np.array([f[0] for f in factors],dtype=dtype)[:,None,:]
+        sy = np.array([f[1] for f in factors],dtype=dtype)[:,:,None]
+        fx = np.array([f[2] for f in factors],dtype=dtype)[:,None,:]
+        fy = np.array([f[3] for f in factors],dtype=dtype)[:,:,None]
+        dx[k0:k1] = [f[4] for f in factors]
+        dy[k0:k1] = [f[5] for f in factors]
+
+        U = u0*sy                                       # source chirps of all
+        U *= sx                                         # planes in the chunk
+        U = fftb.fft2(U)                                # one batched FFT
+        U *= fy
+        U *= fx
+        if intensity:
+            out[k0:k1] = EPSILON0*C/2*np.abs(U)**2
+        else:
+            out[k0:k1] = U
+        if isinstance(out,np.memmap):
+            out.flush()                                 # the chunk is on disk
+
+    return out,dx,dy